@@ -1,13 +1,13 @@
 from typing import Sequence
 
-import numpy as np
-
 from algorithms.multi_vehicle_mip.implementation.custom_types import Solver, SolverConstraintMap
 from algorithms.multi_vehicle_mip.implementation.definitions import (
+    MVMIP_PROBLEM_CACHE,
     MVMIPObstacle,
+    MVMIPObstacleBatch,
     MVMIPOptimizationParams,
-    MVMIPRectangleObstacle,
     MVMIPVehicle,
+    MVMIPVehicleBatch,
 )
 from algorithms.multi_vehicle_mip.implementation.utils import assert_uniqueness_and_update_mvmip_map
 from algorithms.multi_vehicle_mip.implementation.utils import (
@@ -174,19 +174,18 @@ def construct_state_transition_constraints(
     solver: Solver,
     mvmip_params: MVMIPOptimizationParams,
     vehicle_id: int,
-    vehicle: MVMIPVehicle,
+    vehicle_batch: MVMIPVehicleBatch,
 ) -> SolverConstraintMap:
 
     cons_map = {}
 
     nt = mvmip_params.num_time_steps
-    nx = vehicle.dynamics.a_matrix.shape[0]
-    nu = vehicle.dynamics.b_matrix.shape[1]
-    a_mat, b_mat = vehicle.dynamics.a_matrix, vehicle.dynamics.b_matrix
-    initial_state = vehicle.dynamics.initial_state
+    a_mat = vehicle_batch.a_matrices[vehicle_id]
+    b_mat = vehicle_batch.b_matrices[vehicle_id]
+    nx, nu = b_mat.shape
+    initial_transition_state = vehicle_batch.initial_transition_states[vehicle_id]
 
-    assert a_mat.shape[1] == nx
-    assert initial_state.size == nx
+    assert a_mat.shape == (nx, nx)
 
     for time_step_id in range(nt):
 
@@ -214,7 +213,7 @@ def construct_state_transition_constraints(
             assert cons_var not in cons_map
             if current_time_step_id == 0:
                 # For the first step, we have an equality constraint that is equal to A_p(row) * s_pi
-                cons_eq_value = np.dot(a_mat[next_state_id, :], initial_state)
+                cons_eq_value = initial_transition_state[next_state_id]
             else:
                 # For all other steps, the constraint is equal to 0.
                 cons_eq_value = 0.0
@@ -260,89 +259,59 @@ def construct_vehicle_obstacle_collision_constraints(
     solver: Solver,
     mvmip_params: MVMIPOptimizationParams,
     vehicle_id: int,
-    obstacles: Sequence[MVMIPObstacle],
+    obstacle_batch: MVMIPObstacleBatch,
 ) -> SolverConstraintMap:
 
     cons_map = {}
 
     nt = mvmip_params.num_time_steps
-    dt = mvmip_params.dt
+    assert obstacle_batch.num_time_steps == nt
+    assert obstacle_batch.dt == mvmip_params.dt
 
     # Note that we assume the first two values in the state vector are x & y
-    for obstacle_id, obstacle in enumerate(obstacles):
-        if not isinstance(obstacle, MVMIPRectangleObstacle):
-            raise NotImplemented("Only rectangular obstacles have been implemented so far.")
+    for obstacle_id in range(obstacle_batch.num_obstacles):
+        # (N + 1, 4, 3) as python floats, as they are only used as solver coefficients.
+        obstacle_halfspaces = obstacle_batch.halfspaces[obstacle_id].tolist()
         for time_step_id in range(1, nt + 1):
             # The constraints are of the form:
             # x_pi <= x_cmin + Mt_pci1
             # -x_pi <= -x_cmax + Mt_pci2
             # y_pi <= y_cmin + Mt_pci3
             # -y_pi <= -y_cmax + Mt_pci4
+            # Each of these is an obstacle half plane a.p <= b, relaxed by Mt_pci*
 
-            # state_id to var_id map is as follows:
+            # var_id to state_id map is as follows:
             # 0 -> 0
-            # 0 -> 1
-            # 1 -> 2
-            # 1 -> 3
+            # 1 -> 0
+            # 2 -> 1
+            # 3 -> 1
             # The first two constraints are on x and the next two are on y.
             # Again assuming that x and y are the first two terms in the state vector.
-            for state_id in range(2):
+            for var_id, (*a_xy, b) in enumerate(obstacle_halfspaces[time_step_id]):
+                state_id = var_id // 2
                 s_var_str = s_v(
                     vehicle_id=vehicle_id,
                     time_step_id=time_step_id,
                     state_id=state_id,
                 )
-                # First constraint
-                # s_pi - Mt_* <= o_min
+                # a_* * s_pi - Mt_* <= b
                 t_var_str = voc_bsv(
                     vehicle_id=vehicle_id,
                     obstacle_id=obstacle_id,
                     time_step_id=time_step_id,
-                    var_id=state_id * 2,
-                )
-                cons_var = voc_c(
-                    state_var_str=s_var_str,
-                    binary_var_str=t_var_str,
-                )
-                assert cons_var not in cons_map
-                min_limits_xy = obstacle.compute_min_limits_xy(
-                    time_step_id=time_step_id,
-                    num_time_steps=nt,
-                    dt=dt,
-                )
-                constraint = solver.Constraint(
-                    -solver.infinity(),
-                    min_limits_xy[state_id],
-                    cons_var,
-                )
-                constraint.SetCoefficient(solver.LookupVariable(s_var_str), 1.0)
-                constraint.SetCoefficient(solver.LookupVariable(t_var_str), -mvmip_params.M)
-                cons_map[cons_var] = constraint
-
-                # Second constraint
-                # -s_pi - Mt_* <= -o_max
-                t_var_str = voc_bsv(
-                    vehicle_id=vehicle_id,
-                    obstacle_id=obstacle_id,
-                    time_step_id=time_step_id,
-                    var_id=state_id * 2 + 1,
+                    var_id=var_id,
                 )
                 cons_var = voc_c(
                     state_var_str=s_var_str,
                     binary_var_str=t_var_str,
                 )
                 assert cons_var not in cons_map
-                max_limits_xy = obstacle.compute_max_limits_xy(
-                    time_step_id=time_step_id,
-                    num_time_steps=nt,
-                    dt=dt,
-                )
                 constraint = solver.Constraint(
                     -solver.infinity(),
-                    -max_limits_xy[state_id],
+                    b,
                     cons_var,
                 )
-                constraint.SetCoefficient(solver.LookupVariable(s_var_str), -1.0)
+                constraint.SetCoefficient(solver.LookupVariable(s_var_str), a_xy[state_id])
                 constraint.SetCoefficient(solver.LookupVariable(t_var_str), -mvmip_params.M)
                 cons_map[cons_var] = constraint
 
@@ -376,19 +345,20 @@ def construct_vehicle_vehicle_collision_constraints(
     solver: Solver,
     mvmip_params: MVMIPOptimizationParams,
     vehicle_id: int,
-    vehicles: Sequence[MVMIPVehicle],
+    vehicle_batch: MVMIPVehicleBatch,
 ) -> SolverConstraintMap:
 
     cons_map = {}
 
     nt = mvmip_params.num_time_steps
     current_vehicle_id = vehicle_id
+    # Computing dx=dy=d for all the other vehicles at once.
+    d_ms = (
+        vehicle_batch.clearances_m[current_vehicle_id] + vehicle_batch.clearances_m
+    )
 
-    for other_vehicle_id in range(vehicle_id + 1, len(vehicles)):
-        # Computing dx=dy=d
-        current_vehicle_d_m = vehicles[current_vehicle_id].dynamics.clearance_m
-        other_vehicle_d_m = vehicles[other_vehicle_id].dynamics.clearance_m
-        d_m = current_vehicle_d_m + other_vehicle_d_m
+    for other_vehicle_id in range(vehicle_id + 1, vehicle_batch.num_vehicles):
+        d_m = d_ms[other_vehicle_id]
 
         for time_step_id in range(1, nt + 1):
             # Constraint is of the form
@@ -489,6 +459,17 @@ def construct_constraints_for_mvmip(
 
     cons_map = {}
 
+    # The vehicle dynamics and the obstacle time step arrays are required across vehicles,
+    # so these are stacked up once for all of them. The obstacle arrays are also reused
+    # across solves with the same obstacles and horizon.
+    vehicle_batch = MVMIPVehicleBatch.from_vehicles(vehicles=vehicles)
+    obstacle_batch = MVMIP_PROBLEM_CACHE.obstacle_batch(
+        obstacles=obstacles,
+        num_time_steps=mvmip_params.num_time_steps,
+        dt=mvmip_params.dt,
+        dtype=mvmip_params.numeric_dtype,
+    )
+
     for vehicle_id, vehicle in enumerate(vehicles):
 
         # State slack constraints
@@ -510,19 +491,19 @@ def construct_constraints_for_mvmip(
             solver=solver,
             mvmip_params=mvmip_params,
             vehicle_id=vehicle_id,
-            vehicle=vehicle,
+            vehicle_batch=vehicle_batch,
         )
         voc_cons_map = construct_vehicle_obstacle_collision_constraints(
             solver=solver,
             mvmip_params=mvmip_params,
             vehicle_id=vehicle_id,
-            obstacles=obstacles,
+            obstacle_batch=obstacle_batch,
         )
         vvc_cons_map = construct_vehicle_vehicle_collision_constraints(
             solver=solver,
             mvmip_params=mvmip_params,
             vehicle_id=vehicle_id,
-            vehicles=vehicles,
+            vehicle_batch=vehicle_batch,
         )
 
         for individual_cons_map in [
@@ -1,8 +1,12 @@
-from functools import lru_cache
-from typing import Protocol, Sequence, Union
+import functools
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple, Union
 
 import attr
 import numpy as np
+import numpy.typing as npt
 
 from algorithms.multi_vehicle_mip.implementation.custom_types import (
     VehicleControlTrajectoryMap,
@@ -13,12 +17,22 @@ from common.custom_types import (
     AMatrix,
     BMatrix,
     ControlInputVector,
+    ControlTrajectoryTensor,
     CostVector,
+    HalfspacesXYTensor,
+    MatrixMNf64,
+    NpArrf64,
     PointXYArray,
+    PointXYTensor,
     PointXYVector,
     PolygonXYArray,
+    PolygonXYTensor,
+    SizeXYArray,
     SizeXYVector,
+    StateTrajectoryTensor,
     StateVector,
+    TensorLMNf64,
+    VectorNf64,
     VelocityXYArray,
     VelocityXYVector,
 )
@@ -30,6 +44,10 @@ class MVMIPOptimizationParams:
     dt: float
     M: float
     result_float_precision: int
+    # Dtype of the obstacle geometry (centers, limits, corners) used to construct the
+    # constraints. Float32 halves the memory traffic of the large (K, N + 1, ...) arrays,
+    # and is usually precise enough given result_float_precision and the solver tolerances.
+    numeric_dtype: np.dtype = attr.ib(default=np.float64, converter=np.dtype)
 
 
 @attr.frozen
@@ -53,88 +71,460 @@ class MVMIPVehicleOptimizationParams:
     control_max: ControlInputVector = attr.ib(converter=AttrsConverters.np_f64_converter())
 
 
-@attr.frozen
+# Plain container without any converters, so attrs doesn't add anything here.
+@dataclass(frozen=True, slots=True)
 class MVMIPVehicle:
     dynamics: MVMIPVehicleDynamics
     optimization_params: MVMIPVehicleOptimizationParams
 
 
-@attr.frozen(slots=False, eq=False)
-class MVMIPObstacle(Protocol):
-    initial_center_xy: PointXYVector = attr.ib(converter=AttrsConverters.np_f64_converter())
-    size_xy_m: SizeXYVector = attr.ib(converter=AttrsConverters.np_f64_converter())
-    velocities_xy_mps: Union[VelocityXYVector, VelocityXYArray] = attr.ib(
-        converter=AttrsConverters.np_f64_converter()
-    )
-    clearance_m: float
+@attr.frozen
+class MVMIPVehicleBatch:
+    """
+    Dynamics of all the vehicles stacked along the first axis.
+    Assumes that all the vehicles have the same state and control dimensions.
+    """
+
+    # (V, nx, nx)
+    a_matrices: TensorLMNf64
+    # (V, nx, nu)
+    b_matrices: TensorLMNf64
+    # (V,)
+    clearances_m: VectorNf64
+    # (V, nx) A_p @ s_p0 for each vehicle. As s_p0 is not a variable, this is the
+    # constant term of the first state transition constraint.
+    initial_transition_states: MatrixMNf64
+
+    @classmethod
+    def from_vehicles(
+        cls,
+        vehicles: Sequence[MVMIPVehicle],
+    ) -> "MVMIPVehicleBatch":
+        assert len(vehicles) > 0
+        assert (
+            len({vehicle.dynamics.b_matrix.shape for vehicle in vehicles}) == 1
+        ), "All vehicles must have the same state and control dimensions."
+
+        a_matrices = np.stack([vehicle.dynamics.a_matrix for vehicle in vehicles])
+        initial_states = np.stack(
+            [vehicle.dynamics.initial_state for vehicle in vehicles]
+        )
+        return cls(
+            a_matrices=a_matrices,
+            b_matrices=np.stack([vehicle.dynamics.b_matrix for vehicle in vehicles]),
+            clearances_m=np.array(
+                [vehicle.dynamics.clearance_m for vehicle in vehicles],
+                dtype=np.float64,
+            ),
+            initial_transition_states=np.einsum(
+                "vij,vj->vi", a_matrices, initial_states
+            ),
+        )
+
+    @property
+    def num_vehicles(self) -> int:
+        return self.a_matrices.shape[0]
+
 
+class MVMIPObstacle(ABC):
+    """
+    Base class for all MVMIP obstacles.
+    Defines no slots of its own so that the (slotted) obstacle subclasses don't get a __dict__.
+    """
+
+    __slots__ = ()
+
+    initial_center_xy: PointXYVector
+    # (1, 2) for constant velocities or (N, 2) for time varying velocities.
+    velocities_xy_mps: VelocityXYArray
+    clearance_m: float
+    # Per instance (bounded) memos of the time step arrays, by name. These are used
+    # instead of lru_cache, as a global cache would hold on to every obstacle ever created.
+    # Only created on first use, as the constraint construction goes through
+    # MVMIPObstacleBatch and most obstacles never need them.
+    _memos: Optional[Dict[str, "_LRUMemo"]]
+
+    def _memo(self, name: str) -> "_LRUMemo":
+        if self._memos is None:
+            # The memos aren't part of the value of the (frozen) obstacle.
+            object.__setattr__(self, "_memos", {})
+        memo = self._memos.get(name)
+        if memo is None:
+            memo = self._memos[name] = _LRUMemo()
+        return memo
+
+    def memo_info(self) -> Dict[str, "MemoInfo"]:
+        if self._memos is None:
+            return {}
+        return {name: memo.info() for name, memo in self._memos.items()}
+
+    @abstractmethod
     def ordered_corner_points_xy(
         self,
         time_step_id: int,
         num_time_steps: int,
         dt: float,
         add_clearance: bool,
+        dtype: npt.DTypeLike = np.float64,
     ) -> PolygonXYArray:
-        raise NotImplemented
+        raise NotImplementedError
+
+
+# Max number of distinct queries (num_time_steps, dt, ...) memoized per obstacle.
+OBSTACLE_MEMO_MAXSIZE = 128
+# Max number of distinct problems (obstacles, num_time_steps, dt, dtype) cached.
+PROBLEM_CACHE_MAXSIZE = 16
+
+
+@attr.frozen
+class MemoInfo:
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+@attr.define
+class _LRUMemo:
+    """
+    Bounded least recently used memo, like the one lru_cache keeps internally.
+    Owned by an instance so that it is freed along with it.
+    """
+
+    maxsize: int = OBSTACLE_MEMO_MAXSIZE
+    _entries: "OrderedDict[Tuple, Any]" = attr.ib(init=False, factory=OrderedDict)
+    _hits: int = attr.ib(init=False, default=0)
+    _misses: int = attr.ib(init=False, default=0)
+
+    def get(self, key: Tuple) -> Any:
+        value = self._entries.get(key)
+        if value is None:
+            self._misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return value
+
+    def put(self, key: Tuple, value: Any) -> None:
+        self._entries[key] = value
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def info(self) -> MemoInfo:
+        return MemoInfo(
+            hits=self._hits,
+            misses=self._misses,
+            maxsize=self.maxsize,
+            currsize=len(self._entries),
+        )
+
+
+# Signs of the half sizes that give the ordered (clockwise from the bottom left) corners of a rectangle.
+_ORDERED_CORNER_SIGNS_XY = np.array(
+    [
+        [-1.0, -1.0],
+        [-1.0, 1.0],
+        [1.0, 1.0],
+        [1.0, -1.0],
+    ],
+    dtype=np.float64,
+)
+
+
+def _readonly_np_f64_converter(value: Any) -> NpArrf64:
+    """
+    Read only float64 copy of the value. The obstacle arrays can't be modified in place,
+    so the memos only need to be keyed on the query arguments.
+    """
+    np_value = AttrsConverters.np_f64_converter()(value)
+    np_value.setflags(write=False)
+    return np_value
+
+
+def _velocities_xy_converter(
+    value: Union[VelocityXYVector, VelocityXYArray],
+) -> VelocityXYArray:
+    """
+    Normalizes the obstacle velocities to a (1, 2) (constant) or (N, 2) (time varying)
+    array at construction, so that they never need to be special cased afterwards.
+    """
+    velocities_xy_mps = _readonly_np_f64_converter(value)
+    assert velocities_xy_mps.ndim in (1, 2)
+    assert velocities_xy_mps.shape[-1] == 2
+    # The reshaped view is read only as well.
+    return velocities_xy_mps.reshape(-1, 2)
+
+
+def _broadcast_velocities_xy(
+    velocities_xy_mps: VelocityXYArray,
+    num_time_steps: int,
+) -> VelocityXYArray:
+    """
+    Velocities at each time step, of shape (num_time_steps, 2).
+    Constant velocities are expanded as a zero-copy (read only) view, which is fine as the
+    center computations only read from it.
+    """
+    assert velocities_xy_mps.shape[0] in (1, num_time_steps)
+    return np.broadcast_to(velocities_xy_mps, (num_time_steps, 2))
+
+
+def _compute_centers_xy(
+    initial_center_xy: PointXYVector,
+    velocities_xy_mps: VelocityXYArray,
+    num_time_steps: int,
+    dt: float,
+    dtype: npt.DTypeLike,
+) -> PointXYArray:
+    """
+    Centers of a moving obstacle at each time step, of shape (num_time_steps + 1, 2).
+    """
+    centers_xy = np.empty((num_time_steps + 1, 2), dtype=dtype)
+    velocities_xy_mps = _broadcast_velocities_xy(
+        velocities_xy_mps=velocities_xy_mps,
+        num_time_steps=num_time_steps,
+    )
 
+    # c_i = c_0 + dt * sum_{j < i} v_j, computed in one pass instead of stepping
+    # through each time step.
+    centers_xy[0] = initial_center_xy
+    np.cumsum(velocities_xy_mps, axis=0, dtype=dtype, out=centers_xy[1:])
+    centers_xy[1:] *= dt
+    centers_xy[1:] += initial_center_xy
+
+    return centers_xy
+
+
+def _offset_polygon_xy(
+    polygon: PolygonXYArray,
+    offset_m: float,
+) -> PolygonXYArray:
+    """
+    Offsets a convex polygon outwards such that each of its edges moves out by offset_m.
+    Each vertex moves along the miter of the outward normals of its two adjacent edges,
+    which for an axis aligned rectangle is the same as growing each half size by offset_m.
+    """
+    # Edge i goes from vertex i to vertex i + 1.
+    edges_xy = np.roll(polygon, -1, axis=0) - polygon
+    normals_xy = np.stack((edges_xy[:, 1], -edges_xy[:, 0]), axis=1)
+    normals_xy /= np.linalg.norm(normals_xy, axis=1, keepdims=True)
+    # (dy, -dx) is the outward normal for counter clockwise polygons, so it needs to be
+    # flipped for clockwise ones (negative signed area).
+    signed_area = 0.5 * np.sum(
+        polygon[:, 0] * np.roll(polygon[:, 1], -1)
+        - np.roll(polygon[:, 0], -1) * polygon[:, 1]
+    )
+    if signed_area < 0.0:
+        normals_xy = -normals_xy
 
-@attr.frozen(slots=False, eq=False)
-class MVMIPRectangleObstacle:
-    initial_center_xy: PointXYVector = attr.ib(converter=AttrsConverters.np_f64_converter())
-    size_xy_m: SizeXYVector = attr.ib(converter=AttrsConverters.np_f64_converter())
-    velocities_xy_mps: Union[VelocityXYVector, VelocityXYArray] = attr.ib(
-        converter=AttrsConverters.np_f64_converter()
+    # Vertex i is shared by the edges i - 1 and i.
+    prev_normals_xy = np.roll(normals_xy, 1, axis=0)
+    miters_xy = (prev_normals_xy + normals_xy) / (
+        1.0 + np.sum(prev_normals_xy * normals_xy, axis=1, keepdims=True)
+    )
+    return polygon + offset_m * miters_xy
+
+
+def _fill_ordered_corner_points_xy(
+    centers_xy: PointXYArray,
+    half_sizes_xy: SizeXYVector,
+    out: PolygonXYTensor,
+) -> None:
+    """
+    Fills out (of shape (N, 4, 2)) with the ordered corner points of the rectangles
+    centered at each of the N centers.
+    Written in a single pass into the preallocated buffer, without any intermediate
+    (N, 4, 2) temporaries.
+    """
+    np.add(
+        centers_xy[:, np.newaxis, :],
+        _ORDERED_CORNER_SIGNS_XY * half_sizes_xy,
+        out=out,
     )
+
+
+# Normals of the half planes that a point must lie in (at least one of) to be outside an
+# axis aligned rectangle: x <= x_min, -x <= -x_max, y <= y_min, -y <= -y_max.
+# The order is the same as that of the binary slack variables of the collision constraints.
+_AABB_HALFSPACE_NORMALS_XY = np.array(
+    [
+        [1.0, 0.0],
+        [-1.0, 0.0],
+        [0.0, 1.0],
+        [0.0, -1.0],
+    ],
+    dtype=np.float64,
+)
+
+
+def _fill_aabb_halfspace_offsets(
+    min_limits_xy: PointXYTensor,
+    max_limits_xy: PointXYTensor,
+    out: HalfspacesXYTensor,
+) -> None:
+    """
+    Fills in only the b column of out (of shape (..., 4, 3)), for the rectangles given by
+    the (..., 2) min and max limits.
+    """
+    out[..., 0, 2] = min_limits_xy[..., 0]
+    np.negative(max_limits_xy[..., 0], out=out[..., 1, 2])
+    out[..., 2, 2] = min_limits_xy[..., 1]
+    np.negative(max_limits_xy[..., 1], out=out[..., 3, 2])
+
+
+@attr.frozen(slots=True, eq=False)
+class MVMIPRectangleObstacle(MVMIPObstacle):
+    initial_center_xy: PointXYVector = attr.ib(converter=_readonly_np_f64_converter)
+    size_xy_m: SizeXYVector = attr.ib(converter=_readonly_np_f64_converter)
+    velocities_xy_mps: VelocityXYArray = attr.ib(converter=_velocities_xy_converter)
     clearance_m: float
 
-    @lru_cache
+    _memos: Optional[Dict[str, _LRUMemo]] = attr.ib(
+        init=False, default=None, repr=False
+    )
+    # Half sizes without and with clearance. These are invariants of the (frozen)
+    # obstacle, so they are only computed once.
+    _half_sizes_xy_m: SizeXYVector = attr.ib(init=False, repr=False)
+    _half_sizes_with_clearance_xy_m: SizeXYVector = attr.ib(init=False, repr=False)
+
+    @_half_sizes_xy_m.default
+    def _initialize_half_sizes_xy_m(self) -> SizeXYVector:
+        return 0.5 * self.size_xy_m
+
+    @_half_sizes_with_clearance_xy_m.default
+    def _initialize_half_sizes_with_clearance_xy_m(self) -> SizeXYVector:
+        return 0.5 * self.size_xy_m + self.clearance_m
+
     def get_centers_xy(
         self,
         num_time_steps: int,
         dt: float,
+        dtype: npt.DTypeLike = np.float64,
     ) -> PointXYArray:
-        centers_xy = np.empty((num_time_steps + 1, 2), dtype=np.float64)
+        key = (num_time_steps, dt, np.dtype(dtype).str)
+        centers_xy = self._memo("centers_xy").get(key)
+        if centers_xy is not None:
+            return centers_xy
+
+        centers_xy = _compute_centers_xy(
+            initial_center_xy=self.initial_center_xy,
+            velocities_xy_mps=self.velocities_xy_mps,
+            num_time_steps=num_time_steps,
+            dt=dt,
+            dtype=dtype,
+        )
 
-        if self.velocities_xy_mps.size == 2:
-            velocities_xy_mps = np.repeat(
-                self.velocities_xy_mps.reshape(1, 2), num_time_steps, axis=0
-            )
+        self._memo("centers_xy").put(key, centers_xy)
+        return centers_xy
+
+    def all_limits_xy(
+        self,
+        num_time_steps: int,
+        dt: float,
+        dtype: npt.DTypeLike = np.float64,
+    ) -> Tuple[PointXYArray, PointXYArray]:
+        """
+        Min and max limits (including clearance) for all time steps.
+        Computed in one go so that the per time step queries only need to index into them.
+        """
+        key = (num_time_steps, dt, np.dtype(dtype).str)
+        limits_xy = self._memo("limits_xy").get(key)
+        if limits_xy is not None:
+            return limits_xy
+
+        centers_xy = self.get_centers_xy(num_time_steps, dt, dtype)
+        half_sizes_xy = self._half_sizes_with_clearance_xy_m.astype(dtype)
+        limits_xy = (centers_xy - half_sizes_xy, centers_xy + half_sizes_xy)
+
+        self._memo("limits_xy").put(key, limits_xy)
+        return limits_xy
+
+    def all_ordered_corner_points_xy(
+        self,
+        num_time_steps: int,
+        dt: float,
+        add_clearance: bool,
+        dtype: npt.DTypeLike = np.float64,
+    ) -> PolygonXYTensor:
+        """
+        Ordered corner points for all time steps, of shape (num_time_steps + 1, 4, 2).
+        """
+        key = (num_time_steps, dt, add_clearance, np.dtype(dtype).str)
+        corner_points_xy = self._memo("corner_points_xy").get(key)
+        if corner_points_xy is not None:
+            return corner_points_xy
+
+        centers_xy = self.get_centers_xy(num_time_steps, dt, dtype)
+        if add_clearance:
+            half_sizes_xy = self._half_sizes_with_clearance_xy_m
         else:
-            assert self.velocities_xy_mps.ndim == 2
-            assert self.velocities_xy_mps.shape[0] == num_time_steps
-            velocities_xy_mps = self.velocities_xy_mps
+            half_sizes_xy = self._half_sizes_xy_m
+
+        corner_points_xy = np.empty((num_time_steps + 1, 4, 2), dtype=dtype)
+        _fill_ordered_corner_points_xy(
+            centers_xy=centers_xy,
+            half_sizes_xy=half_sizes_xy,
+            out=corner_points_xy,
+        )
 
-        centers_xy[0] = self.initial_center_xy
-        for i in range(1, num_time_steps + 1):
-            centers_xy[i] = centers_xy[i - 1] + dt * velocities_xy_mps[i - 1]
+        self._memo("corner_points_xy").put(key, corner_points_xy)
+        return corner_points_xy
 
-        return centers_xy
+    def aabb_halfspaces(
+        self,
+        num_time_steps: int,
+        dt: float,
+        dtype: npt.DTypeLike = np.float64,
+    ) -> HalfspacesXYTensor:
+        """
+        Half planes outside the obstacle (including clearance) for all time steps, of shape
+        (num_time_steps + 1, 4, 3). Each row is [a_x, a_y, b] for a.p <= b.
+        As the obstacle is axis aligned, the collision constraints can directly use these
+        instead of going through the corner points.
+        """
+        key = (num_time_steps, dt, np.dtype(dtype).str)
+        halfspaces = self._memo("halfspaces").get(key)
+        if halfspaces is not None:
+            return halfspaces
+
+        # Same as the half planes of a batch of just this obstacle.
+        build_geometry = make_obstacle_geometry_builder(
+            num_obstacles=1,
+            num_time_steps=num_time_steps,
+            dtype=np.dtype(dtype),
+        )
+        halfspaces = build_geometry(
+            centers_xy=self.get_centers_xy(num_time_steps, dt, dtype)[np.newaxis],
+            half_sizes_xy=self._half_sizes_with_clearance_xy_m[np.newaxis],
+        )[0]
+
+        self._memo("halfspaces").put(key, halfspaces)
+        return halfspaces
 
     def compute_min_limits_xy(
         self,
         time_step_id: int,
         num_time_steps: int,
         dt: float,
+        dtype: npt.DTypeLike = np.float64,
     ) -> PointXYVector:
         """
         Min limit for MVMIP optimization.
         This corresponds to the bottom left coordinate (including clearance)
         """
-        centers_xy = self.get_centers_xy(num_time_steps, dt)
-        return centers_xy[time_step_id] - 0.5 * self.size_xy_m - self.clearance_m
+        return self.all_limits_xy(num_time_steps, dt, dtype)[0][time_step_id]
 
     def compute_max_limits_xy(
         self,
         time_step_id: int,
         num_time_steps: int,
         dt: float,
+        dtype: npt.DTypeLike = np.float64,
     ) -> PointXYVector:
         """
         Max limit for MVMIP optimization.
         This corresponds to the bottom left coordinate (including clearance)
         """
-        centers_xy = self.get_centers_xy(num_time_steps, dt)
-        return centers_xy[time_step_id] + 0.5 * self.size_xy_m + self.clearance_m
+        return self.all_limits_xy(num_time_steps, dt, dtype)[1][time_step_id]
 
     def ordered_corner_points_xy(
         self,
@@ -142,52 +532,283 @@ class MVMIPRectangleObstacle:
         num_time_steps: int,
         dt: float,
         add_clearance: bool,
+        dtype: npt.DTypeLike = np.float64,
     ) -> PolygonXYArray:
-        centers_xy = self.get_centers_xy(num_time_steps, dt)
-        xc, yc = centers_xy[time_step_id]
-        if add_clearance:
-            # Half sizes with clearance.
-            xhs, yhs = 0.5 * self.size_xy_m + self.clearance_m
-        else:
-            # Half sizes.
-            xhs, yhs = 0.5 * self.size_xy_m
-
-        return np.array(
-            [
-                [xc - xhs, yc - yhs],
-                [xc - xhs, yc + yhs],
-                [xc + xhs, yc + yhs],
-                [xc + xhs, yc - yhs],
-            ],
-            dtype=np.float64,
-        )
+        return self.all_ordered_corner_points_xy(
+            num_time_steps, dt, add_clearance, dtype
+        )[time_step_id]
 
 
-@attr.frozen
-class MVMIPPolygonObstacle:
-    polygon: PolygonXYArray = attr.ib(converter=AttrsConverters.np_f64_converter())
-    initial_center_xy: PointXYArray = attr.ib(converter=AttrsConverters.np_f64_converter())
-    velocities_xy_mps: Union[VelocityXYVector, VelocityXYArray] = attr.ib(
-        converter=AttrsConverters.np_f64_converter()
-    )
+@attr.frozen(slots=True, eq=False)
+class MVMIPPolygonObstacle(MVMIPObstacle):
+    polygon: PolygonXYArray = attr.ib(converter=_readonly_np_f64_converter)
+    initial_center_xy: PointXYArray = attr.ib(converter=_readonly_np_f64_converter)
+    velocities_xy_mps: VelocityXYArray = attr.ib(converter=_velocities_xy_converter)
     clearance_m: float
 
+    _memos: Optional[Dict[str, _LRUMemo]] = attr.ib(
+        init=False, default=None, repr=False
+    )
+    # Polygon grown by the clearance. An invariant of the (frozen) obstacle.
+    _clearance_polygon: PolygonXYArray = attr.ib(init=False, repr=False)
+
+    @_clearance_polygon.default
+    def _initialize_clearance_polygon(self) -> PolygonXYArray:
+        return _offset_polygon_xy(polygon=self.polygon, offset_m=self.clearance_m)
+
+    def all_polygons_xy(
+        self,
+        num_time_steps: int,
+        dt: float,
+        add_clearance: bool,
+        dtype: npt.DTypeLike = np.float64,
+    ) -> PolygonXYTensor:
+        """
+        Polygon (vertices are relative to the center) placed at the center of each time step,
+        of shape (num_time_steps + 1, P, 2).
+        """
+        key = (num_time_steps, dt, add_clearance, np.dtype(dtype).str)
+        polygons_xy = self._memo("polygons_xy").get(key)
+        if polygons_xy is not None:
+            return polygons_xy
+
+        centers_xy = _compute_centers_xy(
+            initial_center_xy=self.initial_center_xy,
+            velocities_xy_mps=self.velocities_xy_mps,
+            num_time_steps=num_time_steps,
+            dt=dt,
+            dtype=dtype,
+        )
+        polygon = self._clearance_polygon if add_clearance else self.polygon
+        polygons_xy = centers_xy[:, np.newaxis, :] + polygon.astype(dtype)[np.newaxis]
+
+        self._memo("polygons_xy").put(key, polygons_xy)
+        return polygons_xy
+
     def ordered_corner_points_xy(
         self,
-        time_step_id: float,
+        time_step_id: int,
         num_time_steps: int,
         dt: float,
         add_clearance: bool,
+        dtype: npt.DTypeLike = np.float64,
     ) -> PolygonXYArray:
-        raise NotImplementedError
+        return self.all_polygons_xy(num_time_steps, dt, add_clearance, dtype)[
+            time_step_id
+        ]
+
+
+def batched_centers_xy(
+    obstacles: Sequence[MVMIPObstacle],
+    num_time_steps: int,
+    dt: float,
+    dtype: npt.DTypeLike = np.float64,
+) -> PointXYTensor:
+    """
+    Centers of all the obstacles at each time step, of shape (K, num_time_steps + 1, 2).
+    Same as stacking up _compute_centers_xy for each obstacle, but with a single cumsum
+    over all of them.
+    """
+    num_obstacles = len(obstacles)
+    centers_xy = np.empty((num_obstacles, num_time_steps + 1, 2), dtype=dtype)
+    if not num_obstacles:
+        return centers_xy
+
+    initial_centers_xy = np.stack(
+        [obstacle.initial_center_xy for obstacle in obstacles]
+    )
+    # (K, N, 2)
+    velocities_xy_mps = np.stack(
+        [
+            _broadcast_velocities_xy(
+                velocities_xy_mps=obstacle.velocities_xy_mps,
+                num_time_steps=num_time_steps,
+            )
+            for obstacle in obstacles
+        ]
+    )
+
+    centers_xy[:, 0] = initial_centers_xy
+    np.cumsum(velocities_xy_mps, axis=1, dtype=dtype, out=centers_xy[:, 1:])
+    centers_xy[:, 1:] *= dt
+    centers_xy[:, 1:] += initial_centers_xy[:, np.newaxis, :]
+
+    return centers_xy
+
+
+# (centers_xy, half_sizes_xy) -> halfspaces
+ObstacleGeometryBuilder = Callable[[PointXYTensor, SizeXYArray], HalfspacesXYTensor]
+
+
+@functools.lru_cache(maxsize=PROBLEM_CACHE_MAXSIZE)
+def make_obstacle_geometry_builder(
+    num_obstacles: int,
+    num_time_steps: int,
+    dtype: npt.DTypeLike = np.float64,
+) -> ObstacleGeometryBuilder:
+    """
+    Builder of the obstacle half planes, specialized for the given shapes.
+    The shapes and the (constant) half plane normals are fixed once per problem size, so
+    repeated builds only compute (and allocate) the parts that depend on the obstacles.
+    """
+    dtype = np.dtype(dtype)
+    centers_shape = (num_obstacles, num_time_steps + 1, 2)
+    halfspaces_shape = (num_obstacles, num_time_steps + 1, 4, 3)
+    halfspaces_template = np.empty(halfspaces_shape, dtype=dtype)
+    halfspaces_template[..., :2] = _AABB_HALFSPACE_NORMALS_XY
+
+    def _build(
+        centers_xy: PointXYTensor,
+        half_sizes_xy: SizeXYArray,
+    ) -> HalfspacesXYTensor:
+        assert centers_xy.shape == centers_shape
+        assert half_sizes_xy.shape == (num_obstacles, 2)
+
+        # Half sizes broadcast over all time steps.
+        half_sizes_xy = half_sizes_xy[:, np.newaxis, :]
+        min_limits_xy = np.subtract(centers_xy, half_sizes_xy, dtype=dtype)
+        max_limits_xy = np.add(centers_xy, half_sizes_xy, dtype=dtype)
+
+        halfspaces = halfspaces_template.copy()
+        _fill_aabb_halfspace_offsets(
+            min_limits_xy=min_limits_xy,
+            max_limits_xy=max_limits_xy,
+            out=halfspaces,
+        )
+
+        return halfspaces
+
+    return _build
+
+
+@attr.frozen
+class MVMIPObstacleBatch:
+    """
+    Structure of arrays view of a sequence of (rectangle) obstacles for a given
+    number of time steps and dt.
+    The time step arrays of all the obstacles are stacked along the first axis, so that
+    constraint construction can index into them directly instead of calling into
+    each obstacle for every time step.
+    """
+
+    num_time_steps: int
+    dt: float
+    # (K, N + 1, 4, 3) Half planes outside each obstacle (with clearance) at each time step.
+    halfspaces: HalfspacesXYTensor
+
+    @classmethod
+    def from_obstacles(
+        cls,
+        obstacles: Sequence[MVMIPObstacle],
+        num_time_steps: int,
+        dt: float,
+        dtype: npt.DTypeLike = np.float64,
+    ) -> "MVMIPObstacleBatch":
+        for obstacle in obstacles:
+            if not isinstance(obstacle, MVMIPRectangleObstacle):
+                raise NotImplementedError(
+                    "Only rectangular obstacles have been implemented so far."
+                )
+
+        # Reshaping to keep the (K, 2) shape even if there are no obstacles.
+        sizes_xy_m = np.array(
+            [obstacle.size_xy_m for obstacle in obstacles], dtype=dtype
+        ).reshape(-1, 2)
+        clearances_m = np.array(
+            [obstacle.clearance_m for obstacle in obstacles], dtype=dtype
+        )
+        centers_xy = batched_centers_xy(
+            obstacles=obstacles,
+            num_time_steps=num_time_steps,
+            dt=dt,
+            dtype=dtype,
+        )
+
+        build_geometry = make_obstacle_geometry_builder(
+            num_obstacles=len(obstacles),
+            num_time_steps=num_time_steps,
+            dtype=np.dtype(dtype),
+        )
+        # Half sizes with clearance.
+        halfspaces = build_geometry(
+            centers_xy=centers_xy,
+            half_sizes_xy=0.5 * sizes_xy_m + clearances_m[:, np.newaxis],
+        )
+
+        return cls(
+            num_time_steps=num_time_steps,
+            dt=dt,
+            halfspaces=halfspaces,
+        )
+
+    @property
+    def num_obstacles(self) -> int:
+        return self.halfspaces.shape[0]
+
+
+@attr.define
+class MVMIPProblemCache:
+    """
+    Cache of the precomputed problem arrays across solves, so that repeated solves with the
+    same obstacles and horizon (receding horizon planning for example) don't rebuild them.
+    Keyed by the identity of the obstacles, as they are frozen. The obstacles are stored
+    along with the arrays, so their ids cannot be reused while they are cached.
+    """
+
+    maxsize: int = PROBLEM_CACHE_MAXSIZE
+    _obstacle_batches: _LRUMemo = attr.ib(init=False, repr=False)
+
+    @_obstacle_batches.default
+    def _initialize_obstacle_batches(self) -> _LRUMemo:
+        return _LRUMemo(maxsize=self.maxsize)
+
+    def obstacle_batch(
+        self,
+        obstacles: Sequence[MVMIPObstacle],
+        num_time_steps: int,
+        dt: float,
+        dtype: npt.DTypeLike = np.float64,
+    ) -> MVMIPObstacleBatch:
+        obstacles = tuple(obstacles)
+        key = (
+            tuple(id(obstacle) for obstacle in obstacles),
+            num_time_steps,
+            dt,
+            np.dtype(dtype).str,
+        )
+        entry = self._obstacle_batches.get(key)
+        if entry is not None:
+            return entry[1]
+
+        obstacle_batch = MVMIPObstacleBatch.from_obstacles(
+            obstacles=obstacles,
+            num_time_steps=num_time_steps,
+            dt=dt,
+            dtype=dtype,
+        )
+        self._obstacle_batches.put(key, (obstacles, obstacle_batch))
+        return obstacle_batch
+
+    def info(self) -> MemoInfo:
+        return self._obstacle_batches.info()
+
+    def clear(self) -> None:
+        self._obstacle_batches = self._initialize_obstacle_batches()
+
+
+# Default cache used across MVMIP solves.
+MVMIP_PROBLEM_CACHE = MVMIPProblemCache()
 
 
 @attr.frozen
 class MVMIPResult:
     # Actual result attributes.
     objective_value: float
-    vehicle_state_trajectory_map: VehicleStateTrajectoryMap
-    vehicle_control_trajectory_map: VehicleControlTrajectoryMap
+    # Trajectories of all the vehicles stacked into contiguous tensors.
+    # (V, N + 1, nx)
+    state_trajectory_tensor: StateTrajectoryTensor
+    # (V, N, nu)
+    control_trajectory_tensor: ControlTrajectoryTensor
     # Attributes that make the result self-sufficient
     mvmip_params: MVMIPOptimizationParams
     vehicles: Sequence[MVMIPVehicle]
@@ -195,18 +816,16 @@ class MVMIPResult:
     # Performance attributes.
     solver_setup_time_s: float
     solver_solving_time_s: float
+    # Per vehicle trajectories. These are views into the tensors and not copies.
+    vehicle_state_trajectory_map: VehicleStateTrajectoryMap = attr.ib(init=False)
+    vehicle_control_trajectory_map: VehicleControlTrajectoryMap = attr.ib(init=False)
 
+    @vehicle_state_trajectory_map.default
+    def _initialize_vehicle_state_trajectory_map(self) -> VehicleStateTrajectoryMap:
+        return dict(enumerate(self.state_trajectory_tensor))
 
-if __name__ == "__main__":
-
-    @attr.frozen(slots=False, eq=False)
-    class A:
-        a: int
-        v: SizeXYVector
-
-        @lru_cache
-        def f(self, b) -> int:
-            return self.a**2 + b
-
-    a = A(3, np.array([2.0, 3.0]))
-    print(a.f(2))
+    @vehicle_control_trajectory_map.default
+    def _initialize_vehicle_control_trajectory_map(
+        self,
+    ) -> VehicleControlTrajectoryMap:
+        return dict(enumerate(self.control_trajectory_tensor))
@@ -5,8 +5,6 @@ import numpy as np
 from algorithms.multi_vehicle_mip.implementation.custom_types import (
     Solver,
     SolverObjective,
-    VehicleControlTrajectoryMap,
-    VehicleStateTrajectoryMap,
 )
 from algorithms.multi_vehicle_mip.implementation.definitions import (
     MVMIPObstacle,
@@ -22,6 +20,7 @@ from algorithms.multi_vehicle_mip.implementation.utils import (
     state_slack_variable_str_from_ids as s_sv,
 )
 from algorithms.multi_vehicle_mip.implementation.utils import state_variable_str_from_ids as s_v
+from common.custom_types import ControlTrajectoryTensor, StateTrajectoryTensor
 
 
 def construct_objective_for_mvmip(
@@ -75,21 +74,25 @@ def construct_objective_for_mvmip(
     return objective
 
 
-def vehicle_state_and_control_trajectory_map_from_solver(
+def vehicle_state_and_control_trajectory_tensors_from_solver(
     solver: Solver,
     mvmip_params: MVMIPOptimizationParams,
     vehicles: Sequence[MVMIPVehicle],
-) -> Tuple[VehicleStateTrajectoryMap, VehicleControlTrajectoryMap]:
+) -> Tuple[StateTrajectoryTensor, ControlTrajectoryTensor]:
+    """
+    Assumes that all the vehicles have the same state and control dimensions, so that
+    their trajectories can be stacked.
+    """
 
     nt = mvmip_params.num_time_steps
-    vehicle_state_trajectory_map = {}
-    vehicle_control_trajectory_map = {}
+    nx, nu = vehicles[0].dynamics.b_matrix.shape
+    state_trajectory_tensor = np.empty((len(vehicles), nt + 1, nx), dtype=np.float64)
+    control_trajectory_tensor = np.empty((len(vehicles), nt, nu), dtype=np.float64)
 
     for vehicle_id, vehicle in enumerate(vehicles):
-        nx = vehicle.dynamics.a_matrix.shape[0]
-        nu = vehicle.dynamics.b_matrix.shape[1]
-        state_trajectory = np.empty((nt + 1, nx), dtype=np.float64)
-        control_trajectory = np.empty((nt, nx), dtype=np.float64)
+        assert vehicle.dynamics.b_matrix.shape == (nx, nu)
+        state_trajectory = state_trajectory_tensor[vehicle_id]
+        control_trajectory = control_trajectory_tensor[vehicle_id]
 
         state_trajectory[0] = vehicle.dynamics.initial_state
 
@@ -115,14 +118,17 @@ def vehicle_state_and_control_trajectory_map_from_solver(
                     var_str
                 ).solution_value()
 
-        vehicle_state_trajectory_map[vehicle_id] = state_trajectory.round(
-            mvmip_params.result_float_precision,
-        )
-        vehicle_control_trajectory_map[vehicle_id] = control_trajectory.round(
-            mvmip_params.result_float_precision,
-        )
+    # Rounding in place to avoid copying the tensors.
+    state_trajectory_tensor.round(
+        mvmip_params.result_float_precision,
+        out=state_trajectory_tensor,
+    )
+    control_trajectory_tensor.round(
+        mvmip_params.result_float_precision,
+        out=control_trajectory_tensor,
+    )
 
-    return vehicle_state_trajectory_map, vehicle_control_trajectory_map
+    return state_trajectory_tensor, control_trajectory_tensor
 
 
 def mvmip_result_from_solver(
@@ -136,7 +142,7 @@ def mvmip_result_from_solver(
 
     objective_value = np.round(solver.Objective().Value(), mvmip_params.result_float_precision)
 
-    vst_map, vct_map = vehicle_state_and_control_trajectory_map_from_solver(
+    st_tensor, ct_tensor = vehicle_state_and_control_trajectory_tensors_from_solver(
         solver=solver,
         mvmip_params=mvmip_params,
         vehicles=vehicles,
@@ -144,8 +150,8 @@ def mvmip_result_from_solver(
 
     return MVMIPResult(
         objective_value=objective_value,
-        vehicle_state_trajectory_map=vst_map,
-        vehicle_control_trajectory_map=vct_map,
+        state_trajectory_tensor=st_tensor,
+        control_trajectory_tensor=ct_tensor,
         mvmip_params=mvmip_params,
         vehicles=vehicles,
         obstacles=obstacles,
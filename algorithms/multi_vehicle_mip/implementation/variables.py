@@ -107,7 +107,7 @@ def construct_vehicle_obstacle_collision_variables(
     # Vehicle-obstacle collision constraint variables.
     for obstacle_id, obstacle in enumerate(obstacles):
         if not isinstance(obstacle, MVMIPRectangleObstacle):
-            raise NotImplemented("Only rectangular obstacles have been implemented so far.")
+            raise NotImplementedError("Only rectangular obstacles have been implemented so far.")
         for time_step_id in range(1, nt + 1):
             for var_id in range(4):
                 var_str = voc_bsv(
@@ -0,0 +1,293 @@
+import numpy as np
+import pytest
+
+from algorithms.multi_vehicle_mip.implementation.definitions import (
+    OBSTACLE_MEMO_MAXSIZE,
+    MVMIPObstacleBatch,
+    MVMIPPolygonObstacle,
+    MVMIPProblemCache,
+    MVMIPRectangleObstacle,
+    batched_centers_xy,
+)
+
+
+@pytest.fixture
+def rectangle_obstacle() -> MVMIPRectangleObstacle:
+    return MVMIPRectangleObstacle(
+        initial_center_xy=[1.0, 2.0],
+        size_xy_m=[1.0, 2.0],
+        velocities_xy_mps=[-1.5, 2.0],
+        clearance_m=0.1,
+    )
+
+
+@pytest.mark.parametrize("time_varying_velocities", [True, False])
+def test_rectangle_obstacle_centers_xy(time_varying_velocities: bool) -> None:
+    num_time_steps, dt = 20, 0.1
+    if time_varying_velocities:
+        velocities_xy_mps = np.random.default_rng(7).uniform(
+            -2.0, 2.0, size=(num_time_steps, 2)
+        )
+    else:
+        velocities_xy_mps = np.array([-1.5, 2.0])
+
+    obstacle = MVMIPRectangleObstacle(
+        initial_center_xy=[1.0, 2.0],
+        size_xy_m=[1.0, 2.0],
+        velocities_xy_mps=velocities_xy_mps,
+        clearance_m=0.1,
+    )
+    centers_xy = obstacle.get_centers_xy(num_time_steps=num_time_steps, dt=dt)
+
+    expected_centers_xy = np.empty((num_time_steps + 1, 2))
+    expected_centers_xy[0] = obstacle.initial_center_xy
+    for i in range(1, num_time_steps + 1):
+        expected_velocity_xy_mps = (
+            velocities_xy_mps[i - 1] if time_varying_velocities else velocities_xy_mps
+        )
+        expected_centers_xy[i] = (
+            expected_centers_xy[i - 1] + dt * expected_velocity_xy_mps
+        )
+
+    np.testing.assert_allclose(centers_xy, expected_centers_xy)
+
+
+def test_rectangle_obstacle_memo_is_bounded(
+    rectangle_obstacle: MVMIPRectangleObstacle,
+) -> None:
+    centers_xy = rectangle_obstacle.get_centers_xy(num_time_steps=10, dt=0.1)
+    assert rectangle_obstacle.get_centers_xy(num_time_steps=10, dt=0.1) is centers_xy
+
+    for num_time_steps in range(1, OBSTACLE_MEMO_MAXSIZE + 2):
+        rectangle_obstacle.get_centers_xy(num_time_steps=num_time_steps, dt=0.2)
+
+    memo_info = rectangle_obstacle.memo_info()["centers_xy"]
+    assert memo_info.hits == 1
+    assert memo_info.misses == OBSTACLE_MEMO_MAXSIZE + 2
+    assert memo_info.currsize == OBSTACLE_MEMO_MAXSIZE
+    # The least recently used entry has been evicted.
+    assert (
+        rectangle_obstacle.get_centers_xy(num_time_steps=10, dt=0.1) is not centers_xy
+    )
+
+
+def test_rectangle_obstacle_memo_normalizes_dtype(
+    rectangle_obstacle: MVMIPRectangleObstacle,
+) -> None:
+    # Equivalent dtypes share the same memo entry.
+    centers_xy = rectangle_obstacle.get_centers_xy(
+        num_time_steps=10, dt=0.1, dtype=np.float32
+    )
+    for dtype in ("float32", np.dtype("float32")):
+        assert (
+            rectangle_obstacle.get_centers_xy(num_time_steps=10, dt=0.1, dtype=dtype)
+            is centers_xy
+        )
+    assert rectangle_obstacle.memo_info()["centers_xy"].currsize == 1
+
+
+def test_rectangle_obstacle_arrays_are_read_only(
+    rectangle_obstacle: MVMIPRectangleObstacle,
+) -> None:
+    # The memos are keyed on the query arguments alone, which relies on this.
+    for arr in (
+        rectangle_obstacle.initial_center_xy,
+        rectangle_obstacle.size_xy_m,
+        rectangle_obstacle.velocities_xy_mps,
+    ):
+        with pytest.raises(ValueError):
+            arr[0] = 0.0
+
+
+def test_batched_centers_xy(rectangle_obstacle: MVMIPRectangleObstacle) -> None:
+    num_time_steps, dt = 20, 0.1
+    obstacles = [
+        rectangle_obstacle,
+        MVMIPRectangleObstacle(
+            initial_center_xy=[-3.0, 0.5],
+            size_xy_m=[2.0, 1.0],
+            velocities_xy_mps=np.random.default_rng(7).uniform(
+                -2.0, 2.0, size=(num_time_steps, 2)
+            ),
+            clearance_m=0.2,
+        ),
+    ]
+    centers_xy = batched_centers_xy(
+        obstacles=obstacles,
+        num_time_steps=num_time_steps,
+        dt=dt,
+    )
+
+    assert centers_xy.shape == (2, num_time_steps + 1, 2)
+    for obstacle, obstacle_centers_xy in zip(obstacles, centers_xy):
+        np.testing.assert_allclose(
+            obstacle_centers_xy,
+            obstacle.get_centers_xy(num_time_steps=num_time_steps, dt=dt),
+        )
+    assert batched_centers_xy(
+        obstacles=[], num_time_steps=num_time_steps, dt=dt
+    ).shape == (0, num_time_steps + 1, 2)
+
+
+def test_rectangle_obstacle_limits_and_corners(
+    rectangle_obstacle: MVMIPRectangleObstacle,
+) -> None:
+    num_time_steps, dt = 10, 0.1
+    time_step_id = 4
+    xc, yc = rectangle_obstacle.get_centers_xy(num_time_steps=num_time_steps, dt=dt)[
+        time_step_id
+    ]
+
+    np.testing.assert_allclose(
+        rectangle_obstacle.compute_min_limits_xy(
+            time_step_id=time_step_id,
+            num_time_steps=num_time_steps,
+            dt=dt,
+        ),
+        [xc - 0.6, yc - 1.1],
+    )
+    np.testing.assert_allclose(
+        rectangle_obstacle.compute_max_limits_xy(
+            time_step_id=time_step_id,
+            num_time_steps=num_time_steps,
+            dt=dt,
+        ),
+        [xc + 0.6, yc + 1.1],
+    )
+    np.testing.assert_allclose(
+        rectangle_obstacle.ordered_corner_points_xy(
+            time_step_id=time_step_id,
+            num_time_steps=num_time_steps,
+            dt=dt,
+            add_clearance=False,
+        ),
+        [
+            [xc - 0.5, yc - 1.0],
+            [xc - 0.5, yc + 1.0],
+            [xc + 0.5, yc + 1.0],
+            [xc + 0.5, yc - 1.0],
+        ],
+    )
+
+
+def test_rectangle_obstacle_aabb_halfspaces(
+    rectangle_obstacle: MVMIPRectangleObstacle,
+) -> None:
+    num_time_steps, dt = 10, 0.1
+    halfspaces = rectangle_obstacle.aabb_halfspaces(
+        num_time_steps=num_time_steps, dt=dt
+    )
+    min_limits_xy, max_limits_xy = rectangle_obstacle.all_limits_xy(
+        num_time_steps=num_time_steps, dt=dt
+    )
+
+    assert halfspaces.shape == (num_time_steps + 1, 4, 3)
+    for time_step_id in range(num_time_steps + 1):
+        (x_min, y_min), (x_max, y_max) = (
+            min_limits_xy[time_step_id],
+            max_limits_xy[time_step_id],
+        )
+        np.testing.assert_allclose(
+            halfspaces[time_step_id],
+            [
+                [1.0, 0.0, x_min],
+                [-1.0, 0.0, -x_max],
+                [0.0, 1.0, y_min],
+                [0.0, -1.0, -y_max],
+            ],
+        )
+
+    obstacle_batch = MVMIPObstacleBatch.from_obstacles(
+        obstacles=[rectangle_obstacle],
+        num_time_steps=num_time_steps,
+        dt=dt,
+    )
+    np.testing.assert_allclose(obstacle_batch.halfspaces[0], halfspaces)
+
+
+def test_problem_cache_reuses_obstacle_batch(
+    rectangle_obstacle: MVMIPRectangleObstacle,
+) -> None:
+    problem_cache = MVMIPProblemCache(maxsize=2)
+    obstacles = [rectangle_obstacle]
+    obstacle_batch = problem_cache.obstacle_batch(
+        obstacles=obstacles, num_time_steps=10, dt=0.1
+    )
+
+    assert (
+        problem_cache.obstacle_batch(obstacles=obstacles, num_time_steps=10, dt=0.1)
+        is obstacle_batch
+    )
+    # Different horizon or different (but equal valued) obstacles are rebuilt.
+    assert (
+        problem_cache.obstacle_batch(obstacles=obstacles, num_time_steps=20, dt=0.1)
+        is not obstacle_batch
+    )
+    other_obstacle = MVMIPRectangleObstacle(
+        initial_center_xy=rectangle_obstacle.initial_center_xy,
+        size_xy_m=rectangle_obstacle.size_xy_m,
+        velocities_xy_mps=rectangle_obstacle.velocities_xy_mps,
+        clearance_m=rectangle_obstacle.clearance_m,
+    )
+    assert (
+        problem_cache.obstacle_batch(
+            obstacles=[other_obstacle], num_time_steps=10, dt=0.1
+        )
+        is not obstacle_batch
+    )
+
+    memo_info = problem_cache.info()
+    assert memo_info.hits == 1
+    assert memo_info.misses == 3
+    assert memo_info.currsize == 2
+
+
+@pytest.mark.parametrize("add_clearance", [True, False])
+@pytest.mark.parametrize("clockwise", [True, False])
+def test_rectangular_polygon_obstacle_matches_rectangle_obstacle(
+    rectangle_obstacle: MVMIPRectangleObstacle,
+    add_clearance: bool,
+    clockwise: bool,
+) -> None:
+    num_time_steps, dt = 10, 0.1
+    polygon = np.array(
+        [
+            [-0.5, -1.0],
+            [-0.5, 1.0],
+            [0.5, 1.0],
+            [0.5, -1.0],
+        ]
+    )
+    if not clockwise:
+        polygon = polygon[::-1]
+
+    polygon_obstacle = MVMIPPolygonObstacle(
+        polygon=polygon,
+        initial_center_xy=rectangle_obstacle.initial_center_xy,
+        velocities_xy_mps=rectangle_obstacle.velocities_xy_mps,
+        clearance_m=rectangle_obstacle.clearance_m,
+    )
+
+    for time_step_id in range(num_time_steps + 1):
+        expected_corner_points_xy = rectangle_obstacle.ordered_corner_points_xy(
+            time_step_id=time_step_id,
+            num_time_steps=num_time_steps,
+            dt=dt,
+            add_clearance=add_clearance,
+        )
+        if not clockwise:
+            expected_corner_points_xy = expected_corner_points_xy[::-1]
+        np.testing.assert_allclose(
+            polygon_obstacle.ordered_corner_points_xy(
+                time_step_id=time_step_id,
+                num_time_steps=num_time_steps,
+                dt=dt,
+                add_clearance=add_clearance,
+            ),
+            expected_corner_points_xy,
+        )
+
+
+if __name__ == "__main__":
+
+    pytest.main(["-s", "-v", __file__])
@@ -3,24 +3,440 @@ Implementation of the TrajOpt algorithm.
 
 See: https://rll.berkeley.edu/~sachin/papers/Schulman-IJRR2014.pdf
 """
+import logging
 import time
+from collections import OrderedDict
 from itertools import count
-from typing import List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import attr
 import numpy as np
+import scipy.sparse as sp
 
-from algorithms.trajopt.implementation.trajopt_utils import assert_gradient_sizes
-from common.custom_types import VectorNf64
+from common.custom_types import MatrixMNf64, MatrixNNf64, VectorNf64
 from common.exceptions import AtiumOptError
 from common.logging_utils import AtiumLogger
-from common.math_utils import assert_matrix_positive_semidefinite
+from common.math_utils import (
+    assert_matrices_positive_semidefinite,
+    assert_matrix_positive_semidefinite,
+)
 from common.optimization.constructs import QPInputs
 from common.optimization.derivative_splicer import (
     DerivativeSplicedConstraintsFn,
     DerivativeSplicedCostFn,
+    DerivativeSplicedOptFn,
 )
-from common.optimization.qp_solver import is_qp_solved, solve_qp
+from common.optimization.qp_solver import WarmStartedQPSolver, is_qp_solved
+
+
+def _memo_key(x: VectorNf64) -> Tuple:
+    return (x.shape, x.dtype.str, x.tobytes())
+
+
+@attr.define
+class _MemoizedOptFn:
+    """
+    Wraps a derivative spliced function, memoizing its values, gradients and hessians at
+    the last few x that it was evaluated at.
+    Within an iteration, these are required at the same x multiple times
+    (convexification, improvement, convergence and constraint satisfaction checks).
+    The memos are keyed by the contents of x, so they are never stale.
+    """
+
+    fn: DerivativeSplicedOptFn
+    maxsize: int = 4
+    _memos: Dict[str, "OrderedDict[Tuple, Any]"] = attr.ib(init=False, repr=False)
+
+    @_memos.default
+    def _initialize_memos(self) -> Dict[str, "OrderedDict[Tuple, Any]"]:
+        return {"value": OrderedDict(), "grad": OrderedDict(), "hess": OrderedDict()}
+
+    def _memoize(self, memo_name: str, key: Tuple, value: Any) -> None:
+        memo = self._memos[memo_name]
+        memo[key] = value
+        if len(memo) > self.maxsize:
+            memo.popitem(last=False)
+
+    def _evaluate(
+        self,
+        memo_name: str,
+        evaluate_fn: Callable[[VectorNf64], Any],
+        x: VectorNf64,
+    ) -> Any:
+        memo = self._memos[memo_name]
+        key = _memo_key(x)
+        if key in memo:
+            return memo[key]
+        value = evaluate_fn(x)
+        self._memoize(memo_name, key=key, value=value)
+        return value
+
+    def __call__(self, x: VectorNf64) -> Any:
+        return self._evaluate("value", self.fn, x)
+
+    def grad(self, x: VectorNf64) -> Any:
+        return self._evaluate("grad", self.fn.grad, x)
+
+    def hess(self, x: VectorNf64) -> Any:
+        return self._evaluate("hess", self.fn.hess, x)
+
+    def value_grad_hess(self, x: VectorNf64) -> Tuple[Any, Any, Any]:
+        # Evaluated together (and memoized individually) if any of them isn't memoized.
+        key = _memo_key(x)
+        memo_names = ("value", "grad", "hess")
+        if all(key in self._memos[memo_name] for memo_name in memo_names):
+            return tuple(self._memos[memo_name][key] for memo_name in memo_names)
+        values = self.fn.value_grad_hess(x)
+        for memo_name, value in zip(memo_names, values):
+            self._memoize(memo_name, key=key, value=value)
+        return values
+
+    def convexified(self, x: VectorNf64, new_x: VectorNf64) -> Any:
+        # Same as the convexified function of the wrapped function, but uses the
+        # memoized terms at x.
+        delta_x = new_x - x
+        return self(x) + self.grad(x) @ delta_x + 0.5 * delta_x @ self.hess(x) @ delta_x
+
+    def clear(self) -> None:
+        for memo in self._memos.values():
+            memo.clear()
+
+
+def _memoize_opt_fn(fn: Optional[DerivativeSplicedOptFn]) -> Optional[_MemoizedOptFn]:
+    return None if fn is None else _MemoizedOptFn(fn=fn)
+
+
+ConstraintsLinearizeFn = Callable[[VectorNf64], Tuple[VectorNf64, MatrixMNf64]]
+ConstraintsHessianSumFn = Callable[[VectorNf64], MatrixNNf64]
+
+
+@attr.frozen
+class _ConstraintsAssembler:
+    """
+    Functions that linearize a set of constraints and sum up their hessians, specialized
+    once for its number of constraints and variables (which don't change across
+    iterations).
+    Linearization gives the values and gradients as a (num_constraints,) vector and a
+    (num_constraints, n) matrix, even for a single constraint (empty if there are none).
+    The hessian sum is Sum_i Omega[:, :, i], each of which is required to be positive
+    semi-definite.
+    """
+
+    num_constraints: int
+    num_variables: int
+    linearize: ConstraintsLinearizeFn
+    sum_hessians: ConstraintsHessianSumFn
+
+    @classmethod
+    def from_constraints_fn(
+        cls,
+        constraints_fn: Optional[_MemoizedOptFn],
+        x: VectorNf64,
+        hessians_required: bool = False,
+    ) -> "_ConstraintsAssembler":
+        n = x.size
+        if constraints_fn is None:
+            c0 = np.empty(0, dtype=np.float64)
+            W_c = np.empty((0, n), dtype=np.float64)
+
+            def _no_hessians(x: VectorNf64) -> MatrixNNf64:
+                raise AssertionError("There are no constraints.")
+
+            return cls(
+                num_constraints=0,
+                num_variables=n,
+                linearize=lambda x: (c0, W_c),
+                sum_hessians=_no_hessians,
+            )
+
+        # Probing the constraints once to get the number of constraints (their shapes are
+        # validated by TrajOpt._validate_constraint_shapes).
+        # This evaluation is memoized, so it isn't wasted.
+        num_constraints = np.size(constraints_fn(x))
+
+        def _values_and_grads(x: VectorNf64) -> Tuple[Any, Any]:
+            # If the hessians are going to be required, all of them are evaluated (and
+            # memoized) together.
+            if hessians_required:
+                c0, W_c, _ = constraints_fn.value_grad_hess(x)
+                return c0, W_c
+            return constraints_fn(x), constraints_fn.grad(x)
+
+        if num_constraints == 1:
+            # The value is a scalar, the gradient a vector and the hessian a matrix.
+            def _linearize(x: VectorNf64) -> Tuple[VectorNf64, MatrixMNf64]:
+                c0, W_c = _values_and_grads(x)
+                return np.reshape(c0, 1), np.reshape(W_c, (1, n))
+
+            def _sum_hessians(x: VectorNf64) -> MatrixNNf64:
+                Omega = np.asarray(constraints_fn.hess(x), dtype=np.float64)
+                assert_matrix_positive_semidefinite(mat=Omega)
+                return Omega
+
+        else:
+
+            def _linearize(x: VectorNf64) -> Tuple[VectorNf64, MatrixMNf64]:
+                return _values_and_grads(x)
+
+            def _sum_hessians(x: VectorNf64) -> MatrixNNf64:
+                Omega = np.asarray(constraints_fn.hess(x), dtype=np.float64)
+                assert_matrices_positive_semidefinite(mats=np.moveaxis(Omega, 2, 0))
+                return Omega.sum(axis=2)
+
+        return cls(
+            num_constraints=num_constraints,
+            num_variables=n,
+            linearize=_linearize,
+            sum_hessians=_sum_hessians,
+        )
+
+
+@attr.define
+class _SparseTriplets:
+    """
+    Accumulates (row, col, value) triplets of the blocks of a sparse matrix.
+    All the entries of dense blocks are kept, including zeros, so that the sparsity
+    pattern of the matrix doesn't change with the values.
+    """
+
+    rows: List[np.ndarray] = attr.ib(factory=list)
+    cols: List[np.ndarray] = attr.ib(factory=list)
+    values: List[np.ndarray] = attr.ib(factory=list)
+
+    def add_dense_block(self, block: MatrixMNf64, row: int, col: int) -> None:
+        num_rows, num_cols = block.shape
+        self.rows.append(np.repeat(np.arange(row, row + num_rows), num_cols))
+        self.cols.append(np.tile(np.arange(col, col + num_cols), num_rows))
+        self.values.append(np.asarray(block, dtype=np.float64).reshape(-1))
+
+    def add_upper_triangular_block(
+        self, block: MatrixNNf64, row: int, col: int
+    ) -> None:
+        block_rows, block_cols = np.triu_indices(block.shape[0])
+        self.rows.append(row + block_rows)
+        self.cols.append(col + block_cols)
+        self.values.append(np.asarray(block, dtype=np.float64)[block_rows, block_cols])
+
+    def add_diagonal_block(self, size: int, value: float, row: int, col: int) -> None:
+        ids = np.arange(size)
+        self.rows.append(row + ids)
+        self.cols.append(col + ids)
+        self.values.append(np.full(size, fill_value=value, dtype=np.float64))
+
+    def to_csc(self, shape: Tuple[int, int]) -> sp.csc_matrix:
+        if not self.values:
+            return sp.csc_matrix(shape, dtype=np.float64)
+        return sp.coo_matrix(
+            (
+                np.concatenate(self.values),
+                (np.concatenate(self.rows), np.concatenate(self.cols)),
+            ),
+            shape=shape,
+        ).tocsc()
+
+
+def _assemble_convexified_qp_inputs(
+    x: VectorNf64,
+    mu: float,
+    omega_f: VectorNf64,
+    W_f: MatrixNNf64,
+    lg0: VectorNf64,
+    W_lg: MatrixMNf64,
+    lh0: VectorNf64,
+    W_lh: MatrixMNf64,
+    nlg0: VectorNf64,
+    W_nlg: MatrixMNf64,
+    Omega_nlg_sum: Optional[MatrixNNf64],
+    nlh0: VectorNf64,
+    W_nlh: MatrixMNf64,
+    Omega_nlh_sum: Optional[MatrixNNf64],
+) -> QPInputs:
+    """
+    Numeric part of the convexification. Assembles the QP from the (already evaluated)
+    cost gradient and hessian, the constraint values and gradients (of shape
+    (num_constraints,) and (num_constraints, n), empty if there are none) and the summed
+    constraint hessians (None if the constraints aren't modeled as second order).
+    Only depends on arrays, so it is independent of how the functions are evaluated.
+    """
+    n = x.size
+
+    num_lg_constraints, num_lh_constraints = lg0.size, lh0.size
+    num_nl_g_constraints, num_nl_h_constraints = nlg0.size, nlh0.size
+
+    # The non linear constraints are converted into penalties which require slack variables.
+    # Each inequality constraint is converted to a |g|+ penalty which adds a slack variable t_g
+    # for each constraint.
+    # Each equality constraint is converted to a |h| penalty which adds slack variables t_h, s_h
+    # for each constraint.
+    # Assuming the final x matrix is layed out as:
+    # x = [[x]
+    #      [t_g]
+    #      [t_h]
+    #      [s_h]]
+    num_slack_variables = num_nl_g_constraints + 2 * num_nl_h_constraints
+    num_total_variables = n + num_slack_variables
+    # Column offsets of the slack variables.
+    t_g_offset = n
+    t_h_offset = t_g_offset + num_nl_g_constraints
+    s_h_offset = t_h_offset + num_nl_h_constraints
+    # A is sized at the full width upfront, so the slack blocks must tile the columns
+    # after x exactly.
+    assert s_h_offset + num_nl_h_constraints == num_total_variables
+
+    # Setting up the A matrix for OSQP
+    # l <= Ax <= u
+    # The sizes of all the constraint blocks are known at this point, so lb and ub
+    # are allocated once and each block is written into its rows.
+    # A is mostly zeros (the slack columns), so only the triplets of each block are
+    # accumulated and it is constructed as a sparse (CSC) matrix at the end.
+    # A, lb and ub stores the accumulation of the linear (and linearized/linear parts of) constraints
+    # in the form lb <= Ax <= ub as this is what OSQP requires as input.
+    num_rows = (
+        num_lg_constraints
+        + num_lh_constraints
+        + num_nl_g_constraints
+        + num_nl_h_constraints
+        + num_slack_variables
+        + n
+    )
+    A_triplets = _SparseTriplets()
+    lb = np.empty(num_rows, dtype=np.float64)
+    ub = np.empty(num_rows, dtype=np.float64)
+
+    # W stores the accumulation of the required hessians (second order terms) in the cost function.
+    W = np.zeros((n, n), dtype=np.float64)
+    # q stores the accumulation of the linear cost function terms.
+    q = np.zeros(n, dtype=np.float64)
+
+    row = 0
+    if num_lg_constraints:
+        rows = slice(row, row + num_lg_constraints)
+        A_triplets.add_dense_block(W_lg, row=row, col=0)
+        ub[rows] = W_lg @ x - lg0
+        # Lower limits are all -inf for this set.
+        lb[rows] = -np.inf
+        row = rows.stop
+
+    if num_lh_constraints:
+        rows = slice(row, row + num_lh_constraints)
+        A_triplets.add_dense_block(W_lh, row=row, col=0)
+        # As it is an equality constraint, upper and lower bounds are both equal
+        lb[rows] = ub[rows] = W_lh @ x - lh0
+        row = rows.stop
+
+    if num_nl_g_constraints:
+        # The constraint for the non linear terms is slightly different as we have the slack terms.
+        # Instead of Wx <= Wx0 - g(x0), we have
+        # W@x - t_g <= W@x0 - g(x0)
+        # As the actual constarint is g_linearized(x) <= t_g
+        # Wx - t_g then can be represented using A@x where x now also includes the slack terms.
+        # A = [[W 0]     x = [[x]
+        #      [0 -I]]        [t_g]]
+        rows = slice(row, row + num_nl_g_constraints)
+        A_triplets.add_dense_block(W_nlg, row=row, col=0)
+        # The slack terms will correspond to each constraint, so can be mapped using the identity matrix.
+        A_triplets.add_diagonal_block(
+            num_nl_g_constraints, value=-1.0, row=row, col=t_g_offset
+        )
+        ub[rows] = W_nlg @ x - nlg0
+        # Lower limits are again -inf
+        lb[rows] = -np.inf
+        row = rows.stop
+
+        if Omega_nlg_sum is not None:
+            # If we're required to model the inequalities as quadratic terms, the hessian term goes in the
+            # cost function and the linear term goes into the constraints directly.
+            # This is because |g(x)|+ = |g(x0) + W(x0)@(x - x0) + Sum_i (x - x0)^T@Omega[i]@(x - x0)|
+            # Where |g(x)|+ = max(g(x), 0) and Omega = Hessian tensor (matrix for a single constraint)
+            # If the individual Omega[:, :, i] are positive semi-definite, then we can remove this out of the
+            # max() as dx^T @ Omega[i] @ dx >= 0.
+            # Which then gets added to the cost function as:
+            # |g(x)|+ = sum_i dx^T @ Omega[i] @ dx + t_g
+            # Ax + b <= t_g, t_g >= 0, Where Ax + b is the linear form of the approximation.
+
+            # So here for the cost, we expand dx^T @ Omega[i] @ dx and accumulate the quadratic terms
+            # (0.5 * Omega[i]) in W and the linear terms (-0.5 * x0^T @ (Omega[i] + Omega[i]^T)) into q.
+            # Note that the penalty scaling factor mu also multiplies the cost function term.
+
+            # As the terms are summed up over all the constraints, it is equivalent to
+            # accumulate the sum of the Omega[i] (Sum_i Omega[i] + Omega[i]^T = Omega_sum + Omega_sum^T)
+            # Note that OSQP already assumes 0.5 multiplies P, so we don't include that here.
+            W += mu * Omega_nlg_sum
+            # For q, we need to include the 0.5
+            # Note that v.T @ (A + A.T) = ((A + A.T).T @ v).T = (A + A.T) @ v (As it's a vector and the transpose doesn't change the values)
+            # As hessians are symmetric, 0.5 * (A + A.T) @ v = A @ v, which avoids the n x n temporary.
+            q -= mu * (Omega_nlg_sum @ x)
+
+    if num_nl_h_constraints:
+        # Doing the same thing, accounting for the slack terms. It's slightly different
+        # due to having two slack terms for each constraint row.
+        # Constraint is W@x + t_h - s_h = W@x0 - h(x0)
+        # So h_linearized(x) = s_h - t_h, where t_h and s_h are the negative and positive
+        # parts of h, which makes |h| = t_h + s_h at the optimum.
+        # The slack identities are written directly as diagonal blocks.
+        rows = slice(row, row + num_nl_h_constraints)
+        A_triplets.add_dense_block(W_nlh, row=row, col=0)
+        A_triplets.add_diagonal_block(
+            num_nl_h_constraints, value=1.0, row=row, col=t_h_offset
+        )
+        A_triplets.add_diagonal_block(
+            num_nl_h_constraints, value=-1.0, row=row, col=s_h_offset
+        )
+        lb[rows] = ub[rows] = W_nlh @ x - nlh0
+        row = rows.stop
+
+        # Doing the same thing for the equality constraints if required.
+        if Omega_nlh_sum is not None:
+            # Note that OSQP already assumes 0.5 multiplies P, so we don't include that here.
+            W += mu * Omega_nlh_sum
+            # For q, we need to include the 0.5 (which cancels out due to symmetry as above).
+            q -= mu * (Omega_nlh_sum @ x)
+
+    # Constraints for the slack terms t_g, t_h and s_h to be >= 0
+    rows = slice(row, row + num_slack_variables)
+    A_triplets.add_diagonal_block(num_slack_variables, value=1.0, row=row, col=n)
+    lb[rows] = 0.0
+    ub[rows] = np.inf
+    row = rows.stop
+
+    # The trust region box on x goes in the last n rows. Only its bounds change within
+    # the trust region iterations, so they are left unbounded here and set using
+    # TrajOpt.incorporate_trust_region
+    rows = slice(row, row + n)
+    A_triplets.add_diagonal_block(n, value=1.0, row=row, col=0)
+    lb[rows] = -np.inf
+    ub[rows] = np.inf
+    assert rows.stop == num_rows
+    A = A_triplets.to_csc(shape=(num_rows, num_total_variables))
+
+    # For the quadratic term 0.5 x^T@P@x, P is just W_f expanded by zeros to account for the slack terms.
+    # OSQP only uses the upper triangle of P, so only that part is constructed.
+    W_P = W + W_f
+    # Making sure that it is positive semi-definite. As the rest of P is zeros, it is enough
+    # to check the x block.
+    assert_matrix_positive_semidefinite(mat=W_P)
+    P_triplets = _SparseTriplets()
+    P_triplets.add_upper_triangular_block(W_P, row=0, col=0)
+    P = P_triplets.to_csc(shape=(num_total_variables, num_total_variables))
+
+    # For the linear term q^Tx, the first part (x part) of q is given by
+    # omega_f - 0.5 * (W_f + W_f^T)@x0
+    # For proof: Expand f_convex(x) = f(x0) + omega_f^T@(x - x0) + 0.5 * (x - x0)^T@W_f@(x - x0)
+    # f(x0) is not a function of x so can be ignored.
+    # The cost hessian is symmetric, so 0.5 * (W_f + W_f^T)@x0 = W_f@x0
+    q += omega_f - W_f @ x
+    # The second part corresponds to the slack terms and are all equal to the penalty factor as
+    # in the cost function they are sum(t_g) + sum(t_h + s_h)
+    q_aux = np.full(num_slack_variables, fill_value=mu)
+    q = np.hstack((q, q_aux))
+
+    return QPInputs(
+        P=P,
+        q=q,
+        A=A,
+        lb=lb,
+        ub=ub,
+    )
 
 
 # x_tol <= s_0, tau_plus > 1, etc.
@@ -118,18 +534,169 @@ class TrajOpt:
     non_linear_equality_constraints_fn: Optional[DerivativeSplicedConstraintsFn] = None
 
     _logger: AtiumLogger = attr.ib(init=False)
+    # Memoized versions of the functions, which are used internally.
+    _cost_fn_memo: _MemoizedOptFn = attr.ib(init=False, repr=False)
+    _linear_inequality_constraints_fn_memo: Optional[_MemoizedOptFn] = attr.ib(
+        init=False, repr=False
+    )
+    _linear_equality_constraints_fn_memo: Optional[_MemoizedOptFn] = attr.ib(
+        init=False, repr=False
+    )
+    _non_linear_inequality_constraints_fn_memo: Optional[_MemoizedOptFn] = attr.ib(
+        init=False, repr=False
+    )
+    _non_linear_equality_constraints_fn_memo: Optional[_MemoizedOptFn] = attr.ib(
+        init=False, repr=False
+    )
+    # (lg, lh, nlg, nlh) assemblers, specialized at the start of each solve (or the first
+    # convexification if used standalone).
+    _constraints_assemblers: Optional[Tuple[_ConstraintsAssembler, ...]] = attr.ib(
+        init=False, default=None, repr=False
+    )
+    # Within the trust region iterations, only the trust region bounds of the QP change,
+    # so the QP solver workspace is reused and warm started across them.
+    _qp_solver: WarmStartedQPSolver = attr.ib(
+        init=False, factory=WarmStartedQPSolver, repr=False
+    )
 
     @_logger.default
     def _initialize_logger(self) -> AtiumLogger:
         return AtiumLogger(self.__class__.__name__)
 
+    @_cost_fn_memo.default
+    def _initialize_cost_fn_memo(self) -> _MemoizedOptFn:
+        return _MemoizedOptFn(fn=self.cost_fn)
+
+    @_linear_inequality_constraints_fn_memo.default
+    def _initialize_linear_inequality_constraints_fn_memo(
+        self,
+    ) -> Optional[_MemoizedOptFn]:
+        return _memoize_opt_fn(fn=self.linear_inequality_constraints_fn)
+
+    @_linear_equality_constraints_fn_memo.default
+    def _initialize_linear_equality_constraints_fn_memo(
+        self,
+    ) -> Optional[_MemoizedOptFn]:
+        return _memoize_opt_fn(fn=self.linear_equality_constraints_fn)
+
+    @_non_linear_inequality_constraints_fn_memo.default
+    def _initialize_non_linear_inequality_constraints_fn_memo(
+        self,
+    ) -> Optional[_MemoizedOptFn]:
+        return _memoize_opt_fn(fn=self.non_linear_inequality_constraints_fn)
+
+    @_non_linear_equality_constraints_fn_memo.default
+    def _initialize_non_linear_equality_constraints_fn_memo(
+        self,
+    ) -> Optional[_MemoizedOptFn]:
+        return _memoize_opt_fn(fn=self.non_linear_equality_constraints_fn)
+
+    def _clear_fn_memos(self) -> None:
+        for fn_memo in (
+            self._cost_fn_memo,
+            self._linear_inequality_constraints_fn_memo,
+            self._linear_equality_constraints_fn_memo,
+            self._non_linear_inequality_constraints_fn_memo,
+            self._non_linear_equality_constraints_fn_memo,
+        ):
+            if fn_memo is not None:
+                fn_memo.clear()
+
+    def _validate_constraint_shapes(self, x: VectorNf64) -> None:
+        """
+        Validates the shapes of the cost and constraint function outputs at x.
+        These don't change across iterations, so they are only validated once per solve
+        instead of in every convexification.
+        """
+        if np.ndim(x) != 1:
+            raise AtiumOptError(f"x must be a vector, but is of shape {np.shape(x)}")
+        n = x.size
+
+        _, omega_f, W_f = self._cost_fn_memo.value_grad_hess(x)
+        omega_f_shape, W_f_shape = np.shape(omega_f), np.shape(W_f)
+        if omega_f_shape != (n,) or W_f_shape != (n, n):
+            raise AtiumOptError(
+                f"Cost gradient and hessian must be of shapes {(n,)} and {(n, n)}, "
+                f"but are of shapes {omega_f_shape} and {W_f_shape}"
+            )
+
+        # (name, constraints fn, whether the hessians are required)
+        constraints_fn_memos = (
+            ("linear inequality", self._linear_inequality_constraints_fn_memo, False),
+            ("linear equality", self._linear_equality_constraints_fn_memo, False),
+            (
+                "non linear inequality",
+                self._non_linear_inequality_constraints_fn_memo,
+                self.params.second_order_inequalities,
+            ),
+            (
+                "non linear equality",
+                self._non_linear_equality_constraints_fn_memo,
+                self.params.second_order_equalities,
+            ),
+        )
+        for name, fn_memo, hessians_required in constraints_fn_memos:
+            if fn_memo is None:
+                continue
+            if hessians_required:
+                c0, W, Omega = fn_memo.value_grad_hess(x)
+            else:
+                c0, W, Omega = fn_memo(x), fn_memo.grad(x), None
+            c0_shape = np.shape(c0)
+            # For a single/scalar output function, the gradient is a vector and the
+            # hessian a matrix. For multi output, they are a matrix and a tensor.
+            if c0_shape == ():
+                expected_W_shape, expected_Omega_shape = (n,), (n, n)
+            elif len(c0_shape) == 1 and c0_shape[0] > 1:
+                num_constraints = c0_shape[0]
+                expected_W_shape = (num_constraints, n)
+                expected_Omega_shape = (n, n, num_constraints)
+            else:
+                raise AtiumOptError(
+                    f"{name.capitalize()} constraints must be a scalar or a vector of "
+                    f"size > 1, but are of shape {c0_shape}"
+                )
+            W_shape = np.shape(W)
+            if W_shape != expected_W_shape:
+                raise AtiumOptError(
+                    f"{name.capitalize()} constraints gradient must be of shape "
+                    f"{expected_W_shape}, but is of shape {W_shape}"
+                )
+            if hessians_required:
+                Omega_shape = np.shape(Omega)
+                if Omega_shape != expected_Omega_shape:
+                    raise AtiumOptError(
+                        f"{name.capitalize()} constraints hessian must be of shape "
+                        f"{expected_Omega_shape}, but is of shape {Omega_shape}"
+                    )
+
+    def _specialize_constraints_assemblers(self, x: VectorNf64) -> None:
+        self._validate_constraint_shapes(x=x)
+        self._constraints_assemblers = tuple(
+            _ConstraintsAssembler.from_constraints_fn(
+                constraints_fn=fn_memo,
+                x=x,
+                hessians_required=hessians_required,
+            )
+            for fn_memo, hessians_required in (
+                (self._linear_inequality_constraints_fn_memo, False),
+                (self._linear_equality_constraints_fn_memo, False),
+                (
+                    self._non_linear_inequality_constraints_fn_memo,
+                    self.params.second_order_inequalities,
+                ),
+                (
+                    self._non_linear_equality_constraints_fn_memo,
+                    self.params.second_order_equalities,
+                ),
+            )
+        )
+
     def convexify_problem(
         self,
         x: VectorNf64,
         mu: float,
     ) -> QPInputs:
-        assert x.ndim == 1
-        n = x.size
         # Computing the gradient and hessian of the cost function.
         # f = cost function, g = inequality constraints, h = equality constraints
 
@@ -145,262 +712,50 @@ class TrajOpt:
         # A_g@x <= b_g
         # A_h@x = b_h
         # Where x0 just refers to the current x about which we are linearizing.
-
-        # Setting up the A matrix for OSQP
-        # l <= Ax <= u
-        # We compute the A for each linear constraint first and stack them up.
-        # The non linear constraints have a dependency on the slack variables introduced so these
-        # will be added later after A has been expanded.
-
-        # W stores the accumulation of the required hessians (second order terms) in the cost function.
-        W = np.zeros((n, n), dtype=np.float64)
-        # q stores the accumulation of the linear cost function terms.
-        q = np.zeros(n, dtype=np.float64)
-        # A, lb and ub stores the accumulation of the linear (and linearized/linear parts of) constraints
-        # in the form lb <= Ax <= ub as this is what OSQP requires as input.
-        A = np.empty((0, n), dtype=np.float64)
-        lb, ub = np.empty(0), np.empty(0)
-
-        if self.linear_inequality_constraints_fn is not None:
-            lg0 = self.linear_inequality_constraints_fn(x)
-            W_lg = self.linear_inequality_constraints_fn.grad(x)
-
-            assert_gradient_sizes(
-                x0=lg0,
-                x_grad=W_lg,
-                num_variables=n,
-            )
-
-            A_lg = W_lg
-            ub_lg = W_lg @ x - lg0
-            # Lower limits are all -inf for this set.
-            lb_lg = np.full(ub_lg.size, fill_value=-np.inf)
-
-            A = np.vstack((A, A_lg))
-            lb = np.hstack((lb, lb_lg))
-            ub = np.hstack((ub, ub_lg))
-
-        if self.linear_equality_constraints_fn is not None:
-            lh0 = self.linear_equality_constraints_fn(x)
-            W_lh = self.linear_equality_constraints_fn.grad(x)
-
-            assert_gradient_sizes(
-                x0=lh0,
-                x_grad=W_lh,
-                num_variables=n,
-            )
-
-            A_lh = W_lh
-            b_lh = W_lh @ x - lh0
-
-            # As it is an equality constraint, upper and lower bounds are both equal
-            A = np.vstack((A, A_lh))
-            lb = np.hstack((lb, b_lh))
-            ub = np.hstack((ub, b_lh))
-
-        # Before we do the same for the non linear constraints, we first need to compute the
-        # number of non-linear constraints. This will tell us how many slack variables we need
-        # to add to the problem.
-        # Each inequality constraint is converted to a |g|+ penalty which adds a slack variable t_g
-        # for each constraint.
-        # Each equality constraint is converted to a |h| penalty which adds slack variables t_h, s_h
-        # for each constraint.
-        # The A matrix then needs to be expanded (column wise) to account for the new variables
-        # before adding new constraints to it as the new ones depend on the slack variables as well.
-
-        num_nl_g_constraints, num_nl_h_constraints = 0, 0
-        if self.non_linear_inequality_constraints_fn is not None:
-            # The constraint for the non linear terms is slightly different as we have the slack terms.
-            # Instead of Wx <= Wx0 - g(x0), we have
-            # W@x - t_g <= W@x0 - g(x0)
-            # As the actual constarint is g_linearized(x) <= t_g
-            # Wx - t_g then can be represented using A@x where x now also includes the slack terms.
-            # A = [[W 0]     x = [[x]
-            #      [0 -I]]        [t_g]]
-            nlg0 = self.non_linear_inequality_constraints_fn(x)
-            W_nlg = self.non_linear_inequality_constraints_fn.grad(x)
-            num_nl_g_constraints = nlg0.size
-
-            assert_gradient_sizes(
-                x0=nlg0,
-                x_grad=W_nlg,
-                num_variables=n,
-            )
-
-            # Expanding A to account for the new t_g slack variables. As the older constraints don't
-            # depend on the slack variables, these can just be zero.
-            A = np.hstack(
-                (A, np.zeros((A.shape[0], num_nl_g_constraints), dtype=np.float64))
-            )
-
-            A_nlg = W_nlg
-            ub_nlg = W_nlg @ x - nlg0
-            # Lower limits are again -inf
-            lb_nlg = np.full(ub_nlg.size, fill_value=-np.inf)
-
-            # Expanding A_lh as well and changing values to account for the slack terms.
-            # The slack terms will correspond to each constraint, so can be mapped using the identity matrix.
-            A_nlg_aux = -1.0 * np.eye(num_nl_g_constraints)
-            if num_nl_g_constraints == 1:
-                A_nlg = np.hstack((A_nlg, A_nlg_aux.squeeze()))
-            else:
-                A_nlg = np.hstack((A_nlg, A_nlg_aux))
-
-            A = np.vstack((A, A_nlg))
-            lb = np.hstack((lb, lb_nlg))
-            ub = np.hstack((ub, ub_nlg))
-
-            if self.params.second_order_inequalities:
-                # If we're required to model the inequalities as quadratic terms, the hessian term goes in the
-                # cost function and the linear term goes into the constraints directly.
-                # This is because |g(x)|+ = |g(x0) + W(x0)@(x - x0) + Sum_i (x - x0)^T@Omega[i]@(x - x0)|
-                # Where |g(x)|+ = max(g(x), 0) and Omega = Hessian tensor (matrix for a single constraint)
-                # If the individual Omega[:, :, i] are positive semi-definite, then we can remove this out of the
-                # max() as dx^T @ Omega[i] @ dx >= 0.
-                # Which then gets added to the cost function as:
-                # |g(x)|+ = sum_i dx^T @ Omega[i] @ dx + t_g
-                # Ax + b <= t_g, t_g >= 0, Where Ax + b is the linear form of the approximation.
-
-                # So here for the cost, we expand dx^T @ Omega[i] @ dx and accumulate the quadratic terms
-                # (0.5 * Omega[i]) in W and the linear terms (-0.5 * x0^T @ (Omega[i] + Omega[i]^T)) into q.
-                # Note that the penalty scaling factor mu also multiplies the cost function term.
-
-                Omega_nlg = self.non_linear_inequality_constraints_fn.hess(x)
-
-                if num_nl_g_constraints == 1:
-                    # Omega is not a tensor in this case.
-                    assert_matrix_positive_semidefinite(mat=Omega_nlg)
-                    # Note that OSQP already assumes 0.5 multiplies P, so we don't include that here.
-                    W += mu * Omega_nlg
-                    # For q, we need to include the 0.5
-                    # Note that v.T @ (A + A.T) = ((A + A.T).T @ v).T = (A + A.T) @ v (As it's a vector and the transpose doesn't change the values)
-                    q -= 0.5 * mu * ((Omega_nlg + Omega_nlg.T) @ x)
-
-                else:
-                    assert Omega_nlg.ndim == 3
-                    assert Omega_nlg.shape == (n, n, num_nl_g_constraints)
-                    for i in range(n):
-                        omega_nlg = Omega_nlg[:, :, i]
-                        assert_matrix_positive_semidefinite(mat=omega_nlg)
-                        W += mu * omega_nlg
-                        q -= 0.5 * mu * ((omega_nlg + omega_nlg.T) @ x)
-
-        if self.non_linear_equality_constraints_fn is not None:
-            nlh0 = self.non_linear_equality_constraints_fn(x)
-            W_nlh = self.non_linear_equality_constraints_fn.grad(x)
-            num_nl_h_constraints = nlh0.size
-
-            assert_gradient_sizes(
-                x0=nlh0,
-                x_grad=W_nlh,
-                num_variables=n,
-            )
-
-            # Doing the same thing, expanding the A matrices and accounting for the slack terms. It's slightly different
-            # due to having two slack terms for each constraint row.
-
-            A = np.hstack(
-                (A, np.zeros((A.shape[0], 2 * num_nl_h_constraints), dtype=np.float64))
-            )
-            # Offset due to any previous nlg constraints.
-            nlg_offset = A.shape[1] - n - 2 * num_nl_h_constraints
-
-            A_nlh = W_nlh
-            b_nlh = W_nlh @ x - nlh0
-
-            A_nlh_aux = np.zeros(
-                (num_nl_h_constraints, A.shape[1] - n), dtype=np.float64
-            )
-            for i in range(num_nl_h_constraints):
-                # Constraint is W@x - t_h + s_h = W@x0 - h(x0)
-                # Assuming the final x matrix is layed out as:
-                # x = [[x]
-                #      [t_h]
-                #      [s_h]]
-                # Also we need to add the offset to make sure we ignore the g slack terms
-                # if any. If no nlg constraints, this offset will be = 0.
-                A_nlh_aux[i, nlg_offset + i] = 1.0
-                A_nlh_aux[i, nlg_offset + i + num_nl_h_constraints] = -1.0
-
-            if num_nl_h_constraints == 1:
-                # A_lh is 1-D and A_nlh_aux is a 2-D but in 1-D form
-                A_nlh_aux = A_nlh_aux.reshape(nlg_offset + 2 * num_nl_h_constraints)
-            A_nlh = np.hstack((A_nlh, A_nlh_aux))
-
-            A = np.vstack((A, A_nlh))
-            lb = np.hstack((lb, b_nlh))
-            ub = np.hstack((ub, b_nlh))
-
-            # Doing the same thing for the equality constraints if required.
-            if self.params.second_order_equalities:
-                Omega_nlh = self.non_linear_equality_constraints_fn.hess(x)
-
-                if num_nl_h_constraints == 1:
-                    # Omega is not a tensor in this case.
-                    assert_matrix_positive_semidefinite(mat=Omega_nlh)
-                    # Note that OSQP already assumes 0.5 multiplies P, so we don't include that here.
-                    W += mu * Omega_nlh
-                    # For q, we need to include the 0.5
-                    q -= 0.5 * mu * ((Omega_nlh + Omega_nlh.T) @ x)
-
-                else:
-                    assert Omega_nlh.ndim == 3
-                    assert Omega_nlh.shape == (n, n, num_nl_h_constraints)
-                    for i in range(n):
-                        omega_nlh = Omega_nlh[:, :, i]
-                        assert_matrix_positive_semidefinite(mat=omega_nlh)
-                        W += mu * omega_nlh
-                        q -= 0.5 * mu * ((omega_nlh + omega_nlh.T) @ x)
-
-        num_slack_variables = num_nl_g_constraints + 2 * num_nl_h_constraints
-        num_total_variables = n + num_slack_variables
-        assert A.shape[1] == num_total_variables
-
-        # Constraints for the slack terms t_g, t_h and s_h to be >= 0
-        A_slack_bounds = np.zeros(
-            (num_slack_variables, num_total_variables), dtype=np.float64
-        )
-        if num_slack_variables:
-            A_slack_bounds[-num_slack_variables:, -num_slack_variables:] = np.eye(
-                num_slack_variables
-            )
-        lb_slack = np.zeros(num_slack_variables)
-        ub_slack = np.full(num_slack_variables, np.inf)
-
-        A = np.vstack((A, A_slack_bounds))
-        lb = np.hstack((lb, lb_slack))
-        ub = np.hstack((ub, ub_slack))
+        # Specialized again if used standalone with a different number of variables.
+        if (
+            self._constraints_assemblers is None
+            or self._constraints_assemblers[0].num_variables != x.size
+        ):
+            self._specialize_constraints_assemblers(x=x)
+        (
+            lg_assembler,
+            lh_assembler,
+            nlg_assembler,
+            nlh_assembler,
+        ) = self._constraints_assemblers
+
+        lg0, W_lg = lg_assembler.linearize(x)
+        lh0, W_lh = lh_assembler.linearize(x)
+        nlg0, W_nlg = nlg_assembler.linearize(x)
+        nlh0, W_nlh = nlh_assembler.linearize(x)
+        Omega_nlg_sum, Omega_nlh_sum = None, None
+        if nlg_assembler.num_constraints and self.params.second_order_inequalities:
+            Omega_nlg_sum = nlg_assembler.sum_hessians(x)
+        if nlh_assembler.num_constraints and self.params.second_order_equalities:
+            Omega_nlh_sum = nlh_assembler.sum_hessians(x)
 
         # Computing the necessary gradients and hessians for the current x.
         # Cost function. Gradient vector by omega and hessian matrix by W
-        omega_f = self.cost_fn.grad(x)
-        W_f = self.cost_fn.hess(x)
-
-        # For the quadratic term 0.5 x^T@P@x, P is just W_f expanded by zeros to account for the slack terms.
-        P = np.zeros((num_total_variables, num_total_variables), dtype=np.float64)
-        P[:n, :n] = W + W_f
-        # Making sure that it is positive semi-definite.
-        assert_matrix_positive_semidefinite(mat=P)
-
-        # For the linear term q^Tx, the first part (x part) of q is given by
-        # omega_f - 0.5 * (W_f + W_f^T)@x0
-        # For proof: Expand f_convex(x) = f(x0) + omega_f^T@(x - x0) + 0.5 * (x - x0)^T@W_f@(x - x0)
-        # f(x0) is not a function of x so can be ignored.
-        q += omega_f - 0.5 * ((W_f + W_f.T) @ x)
-        # The second part corresponds to the slack terms and are all equal to the penalty factor as
-        # in the cost function they are sum(t_g) + sum(t_h + s_h)
-        q_aux = np.full(num_slack_variables, fill_value=mu)
-        q = np.hstack((q, q_aux))
-
-        assert q.ndim == 1
-        assert q.size == num_total_variables
-
-        return QPInputs(
-            P=P,
-            q=q,
-            A=A,
-            lb=lb,
-            ub=ub,
+        # The cost at x is also required for the improvement checks, so it is evaluated
+        # along with them.
+        _, omega_f, W_f = self._cost_fn_memo.value_grad_hess(x)
+
+        return _assemble_convexified_qp_inputs(
+            x=x,
+            mu=mu,
+            omega_f=omega_f,
+            W_f=W_f,
+            lg0=lg0,
+            W_lg=W_lg,
+            lh0=lh0,
+            W_lh=W_lh,
+            nlg0=nlg0,
+            W_nlg=W_nlg,
+            Omega_nlg_sum=Omega_nlg_sum,
+            nlh0=nlh0,
+            W_nlh=W_nlh,
+            Omega_nlh_sum=Omega_nlh_sum,
         )
 
     def incorporate_trust_region(
@@ -416,25 +771,24 @@ class TrajOpt:
         lb_trust = x - s
         ub_trust = x + s
 
+        # The last n rows of A are already the trust region rows (identity on x), so
+        # only the bounds need to be updated. The bounds are copied so that the
+        # convexified qp_inputs can be reused as the trust region changes.
         n = x.size
-        num_total_variables = qp_inputs.A.shape[1]
-
-        A_trust_bounds = np.zeros((n, num_total_variables), dtype=np.float64)
-        A_trust_bounds[:n, :n] = np.eye(n)
-
-        A = np.vstack((qp_inputs.A, A_trust_bounds))
-        lb = np.hstack((qp_inputs.lb, lb_trust))
-        ub = np.hstack((qp_inputs.ub, ub_trust))
+        trust_rows = slice(qp_inputs.lb.size - n, qp_inputs.lb.size)
+        lb = np.copy(qp_inputs.lb)
+        ub = np.copy(qp_inputs.ub)
+        lb[trust_rows] = lb_trust
+        ub[trust_rows] = ub_trust
 
         return attr.evolve(
             qp_inputs,
-            A=A,
             lb=lb,
             ub=ub,
         )
 
     def compute_convexified_x(self, qp_inputs: QPInputs, size_x: int) -> VectorNf64:
-        osqp_results = solve_qp(qp_inputs=qp_inputs, verbose=False)
+        osqp_results = self._qp_solver.solve(qp_inputs=qp_inputs)
         if is_qp_solved(osqp_results=osqp_results):
             return osqp_results.x[:size_x]
         else:
@@ -446,14 +800,17 @@ class TrajOpt:
         self,
         x: VectorNf64,
         new_x: VectorNf64,
+        cost: float,
+        new_cost: float,
     ) -> bool:
+        # cost and new_cost are f(x) and f(new_x), which are already computed in the solve.
         # new_x should have a lower cost, so improvement is f(old_x) - f(new_x)
-        true_improve = self.cost_fn(x) - self.cost_fn(new_x)
+        true_improve = cost - new_cost
         # For the model improvement, we measure the difference between the cost at x (previous)
         # and the convexified cost at new_x. The convexified cost at x is basically just
         # the full cost at x as delta_x is zero
         # model_improve = self.cost_fn(x) - self.convexified_cost_fn(x=x, new_x=new_x)
-        model_improve = self.cost_fn(x) - self.cost_fn.convexified(x=x, new_x=new_x)
+        model_improve = cost - self._cost_fn_memo.convexified(x=x, new_x=new_x)
 
         return true_improve / model_improve > self.params.c
 
@@ -461,11 +818,13 @@ class TrajOpt:
         self,
         x: VectorNf64,
         new_x: VectorNf64,
+        cost: float,
+        new_cost: float,
     ) -> bool:
-        x_converged = np.linalg.norm(new_x - x) < self.params.x_tol
-        f_converged = (
-            np.linalg.norm(self.cost_fn(new_x) - self.cost_fn(x)) < self.params.f_tol
-        )
+        # Comparing the squared norm to avoid the sqrt.
+        delta_x = new_x - x
+        x_converged = np.dot(delta_x, delta_x) < self.params.x_tol**2
+        f_converged = abs(new_cost - cost) < self.params.f_tol
 
         return x_converged or f_converged
 
@@ -473,45 +832,45 @@ class TrajOpt:
         self,
         x: VectorNf64,
     ) -> bool:
-        constraints_satisfied = True
-        if self.linear_inequality_constraints_fn is not None:
-            lg_satisfied = np.all(
-                self.linear_inequality_constraints_fn(x) <= self.params.c_tol
-            )
-            constraints_satisfied = constraints_satisfied and lg_satisfied
-        if self.linear_equality_constraints_fn is not None:
-            lh_satisfied = np.allclose(
-                self.linear_equality_constraints_fn(x),
-                0.0,
-                atol=self.params.c_tol,
-            )
-            constraints_satisfied = constraints_satisfied and lh_satisfied
-        if self.non_linear_inequality_constraints_fn is not None:
-            nlg_satisfied = np.all(
-                self.non_linear_inequality_constraints_fn(x) <= self.params.c_tol
-            )
-            constraints_satisfied = constraints_satisfied and nlg_satisfied
-        if self.non_linear_equality_constraints_fn is not None:
-            nlh_satisfied = np.allclose(
-                self.non_linear_equality_constraints_fn(x),
-                0.0,
-                atol=self.params.c_tol,
-            )
-            constraints_satisfied = constraints_satisfied and nlh_satisfied
-        return constraints_satisfied
+        # Returns as soon as any set of constraints is violated, so that the remaining
+        # (more expensive non linear) constraint functions aren't evaluated.
+        # Comparisons are written such that NaN values are treated as violations.
+        # (constraints fn, is equality)
+        constraints_fn_memos = (
+            (self._linear_inequality_constraints_fn_memo, False),
+            (self._linear_equality_constraints_fn_memo, True),
+            (self._non_linear_inequality_constraints_fn_memo, False),
+            (self._non_linear_equality_constraints_fn_memo, True),
+        )
+        for fn_memo, is_equality in constraints_fn_memos:
+            if fn_memo is None:
+                continue
+            values = fn_memo(x)
+            if is_equality:
+                values = np.abs(values)
+            if not np.all(values <= self.params.c_tol):
+                return False
+        return True
 
     def solve(
         self,
         initial_guess_x: VectorNf64,
     ) -> TrajOptResult:
         trajopt_solve_start_time = time.perf_counter()
+        # Memos are only required within a solve.
+        self._clear_fn_memos()
+        self._specialize_constraints_assemblers(x=initial_guess_x)
         # Initial values of variables and optimization params.
         x = initial_guess_x
         s = self.params.s_0
         mu = self.params.mu_0
+        # Costs at x and new_x
+        cost = self._cost_fn_memo(initial_guess_x)
+        x_cost = cost
 
         size_x = len(initial_guess_x)
-        new_x = np.copy(x)
+        # new_x is never modified in place (only rebound), so it doesn't need a copy.
+        new_x = x
         updated_s = s
         improvement = True
 
@@ -524,7 +883,7 @@ class TrajOpt:
                 trust_region_iter=0,
                 min_x=initial_guess_x,
                 updated_min_x=initial_guess_x,
-                cost=self.cost_fn(initial_guess_x),
+                cost=cost,
                 trust_region_size=s,
                 updated_trust_region_size=s,
                 improvement=improvement,
@@ -540,23 +899,42 @@ class TrajOpt:
                     x=x,
                     mu=mu,
                 )
+                # Warm starting from the solutions of a different convexification
+                # makes the solves less robust, so it is only done within the trust
+                # region iterations.
+                # The QP solutions are only accurate up to the OSQP tolerances, so
+                # warm started solves can land on slightly different steps than cold
+                # ones, which can change the number of iterations to convergence.
+                self._qp_solver.reset()
                 for trust_region_iter in count():
                     if improvement:
                         x = new_x
+                        x_cost = cost
                     s = updated_s
-                    qp_inputs = self.incorporate_trust_region(
+                    trust_region_qp_inputs = self.incorporate_trust_region(
                         x=x,
                         s=s,
                         qp_inputs=qp_inputs,
                     )
                     # Solving the QP
                     new_x = self.compute_convexified_x(
-                        qp_inputs=qp_inputs,
+                        qp_inputs=trust_region_qp_inputs,
                         size_x=size_x,
                     )
-                    # input()
-                    cost = self.cost_fn(new_x)
-                    improvement = self.is_improvement(x=x, new_x=new_x)
+                    cost = self._cost_fn_memo(new_x)
+                    improvement = self.is_improvement(
+                        x=x,
+                        new_x=new_x,
+                        cost=x_cost,
+                        new_cost=cost,
+                    )
+                    # Guarded so that the message isn't formatted unless required.
+                    if self._logger.is_enabled_for(logging.DEBUG):
+                        self._logger.debug(
+                            f"Iters (penalty, convexify, trust region): "
+                            f"({penalty_iter}, {convexify_iter}, {trust_region_iter}), "
+                            f"s: {s}, mu: {mu}, cost: {cost}, improvement: {improvement}"
+                        )
 
                     result.record_entry(
                         entry=TrajOptEntry(
@@ -585,7 +963,10 @@ class TrajOpt:
                         break
 
                 if trust_region_size_below_threshold or self.is_converged(
-                    x=x, new_x=new_x
+                    x=x,
+                    new_x=new_x,
+                    cost=x_cost,
+                    new_cost=cost,
                 ):
                     break
             if self.are_constraints_satisfied(x=new_x):
@@ -55,8 +55,7 @@ def _visualize_trajopt_rosenbrock_result(
     Y = np.arange(-5.0, 5.1, resolution)
     X, Y = np.meshgrid(X, Y)
     Z_rosenbrock = rosenbrock_fn(x=X, y=Y, a=params.a, b=params.b)
-    min_z, max_z = np.min(Z_rosenbrock), np.max(Z_rosenbrock)
-    nzr, nzc = Z_rosenbrock.shape
+    min_z, max_z = Z_rosenbrock.min(), Z_rosenbrock.max()
 
     # Computing the Z's for each of the constraints so that they can be represented
     # on the plot.
@@ -70,33 +69,36 @@ def _visualize_trajopt_rosenbrock_result(
     Z_nlg = np.full_like(Z_rosenbrock, np.inf)
     Z_nlh = np.full_like(Z_rosenbrock, np.inf)
 
-    for i in range(nzr):
-        for j in range(nzc):
-            x = np.array([X[i, j], Y[i, j]], dtype=np.float64)
+    # (constraints fn, Z, is equality) for the constraints that exist, so that we don't
+    # branch on them for every point of the grid.
+    constraints_fns_and_Zs = [
+        (constraints_fn, Z, is_equality)
+        for constraints_fn, Z, is_equality in (
+            (trajopt.linear_inequality_constraints_fn, Z_lg, False),
+            (trajopt.linear_equality_constraints_fn, Z_lh, True),
+            (trajopt.non_linear_inequality_constraints_fn, Z_nlg, False),
+            (trajopt.non_linear_equality_constraints_fn, Z_nlh, True),
+        )
+        if constraints_fn is not None
+    ]
+    grid_xy = np.stack((X.ravel(), Y.ravel()), axis=1)
+
+    for constraints_fn, Z, is_equality in constraints_fns_and_Zs:
+        # Flat view into Z, so that it is filled up directly.
+        Z_flat = Z.reshape(-1)
+        for point_id, x in enumerate(grid_xy):
             # For the inequality constraints, we set Z to zero if they are satisfied.
             # As the Z's are inf by default, they won't display in the plot and doing
             # this makes sure that the constraint satisfied regions are plotted.
             # For the equality constraints, Z is zero if the constraint is zero.
-            if trajopt.linear_inequality_constraints_fn is not None:
-                if np.all(trajopt.linear_inequality_constraints_fn(x) <= 0):
-                    Z_lg[i, j] = 0.0
-            if trajopt.linear_equality_constraints_fn is not None:
-                # Requires a generous atol here that is > resolution, otherwise nothing would plot.
-                if np.allclose(
-                    trajopt.linear_equality_constraints_fn(x), 0.0, atol=2 * resolution
-                ):
-                    Z_lh[i, j] = 0.0
-            if trajopt.non_linear_inequality_constraints_fn is not None:
-                if np.all(trajopt.non_linear_inequality_constraints_fn(x) <= 0):
-                    Z_nlg[i, j] = 0.0
-            if trajopt.non_linear_equality_constraints_fn is not None:
+            values = np.asarray(constraints_fn(x))
+            if is_equality:
                 # Requires a generous atol here that is > resolution, otherwise nothing would plot.
-                if np.allclose(
-                    trajopt.non_linear_equality_constraints_fn(x),
-                    0.0,
-                    atol=2 * resolution,
-                ):
-                    Z_nlh[i, j] = 0.0
+                satisfied = np.all(np.abs(values) <= 2 * resolution)
+            else:
+                satisfied = np.all(values <= 0)
+            if satisfied:
+                Z_flat[point_id] = 0.0
 
     # Plot the cost surface.
     if plot_cost:
@@ -134,6 +136,8 @@ def _visualize_trajopt_rosenbrock_result(
 
     trust_region_steps = len(result)
     initial_guess_x = result[0].min_x
+    # Stacked once, so that each animation frame only slices it.
+    min_x_history = np.array([entry.min_x for entry in result.entries])
 
     # For the xyz point, we only plot the z coordinate cost if the cost surface needs to be
     # plotted. Otherwise, for just the constraint regions, we plot (x, y, 0) along the
@@ -141,7 +145,7 @@ def _visualize_trajopt_rosenbrock_result(
     xyz_point = ma3.Line3D(
         xs=[initial_guess_x[0]],
         ys=[initial_guess_x[1]],
-        zs=[rosenbrock_cost_fn(initial_guess_x, params)] if plot_cost else [0.0],
+        zs=[result[0].cost] if plot_cost else [0.0],
         marker="o",
         markersize=7,
         color="firebrick",
@@ -160,12 +164,8 @@ def _visualize_trajopt_rosenbrock_result(
         entry = result[trust_region_iter]
         x, y = entry.updated_min_x if entry.improvement else entry.min_x
         cost = entry.cost
-        x_trajectory = [
-            entry.min_x[0] for entry in result.entries[: trust_region_iter + 1]
-        ]
-        y_trajectory = [
-            entry.min_x[1] for entry in result.entries[: trust_region_iter + 1]
-        ]
+        x_trajectory = min_x_history[: trust_region_iter + 1, 0]
+        y_trajectory = min_x_history[: trust_region_iter + 1, 1]
         ax.set_title(
             f"""
             Rosenbrock TrajOpt trust region step: {trust_region_iter + 1}/{trust_region_steps}
@@ -174,7 +174,9 @@ def _visualize_trajopt_rosenbrock_result(
         )
         z = cost if plot_cost else 0.0
         xyz_point.set_data_3d([x], [y], [z])
-        xy_trajectory.set_data_3d(x_trajectory, y_trajectory, [0] * len(x_trajectory))
+        xy_trajectory.set_data_3d(
+            x_trajectory, y_trajectory, np.zeros_like(x_trajectory)
+        )
 
     animation = anim.FuncAnimation(
         fig=fig,
@@ -0,0 +1,283 @@
+import jax.numpy as jnp
+import numpy as np
+import pytest
+
+from algorithms.trajopt.implementation.trajopt import (
+    TrajOpt,
+    TrajOptParams,
+    _MemoizedOptFn,
+)
+from common.custom_types import Scalarf64, VectorNf64
+from common.exceptions import AtiumOptError
+from common.optimization.derivative_splicer import (
+    DerivativeSplicedConstraintsFn,
+    DerivativeSplicedCostFn,
+)
+from common.optimization.standard_functions.rosenbrock import (
+    RosenbrockParams,
+    rosenbrock_cost_fn,
+)
+
+
+@pytest.fixture
+def trajopt_params() -> TrajOptParams:
+    return TrajOptParams(
+        mu_0=1.0,
+        s_0=1e-4,
+        c=1e-2,
+        k=10.0,
+        f_tol=1e-4,
+        x_tol=1e-4,
+        c_tol=1e-2,
+        tau_plus=1.5,
+        tau_minus=0.1,
+        tau_max=10.0,
+        tau_min=1e-4,
+        max_iter=200,
+        second_order_inequalities=True,
+        second_order_equalities=True,
+    )
+
+
+def _quadratic_cost_fn(x: VectorNf64) -> Scalarf64:
+    return jnp.sum((x - 1.0) ** 2)
+
+
+def _circle_constraints_fn(x: VectorNf64) -> Scalarf64:
+    return jnp.sum(x**2) - 4.0
+
+
+def _convex_cost_fn(x: VectorNf64) -> Scalarf64:
+    return (x[0] - 1.0) ** 4 + (x[0] - x[1]) ** 2 + jnp.exp(x[1])
+
+
+def _lg_fn(x: VectorNf64) -> VectorNf64:
+    return jnp.array([x[0] + 2.0 * x[1] - 3.0, -x[0] - 5.0])
+
+
+def _lh_fn(x: VectorNf64) -> Scalarf64:
+    return x[0] - x[1] - 0.5
+
+
+def _nlg_fn(x: VectorNf64) -> VectorNf64:
+    return jnp.array(
+        [
+            (x[0] - 2.0) ** 2 + (x[1] - 2.0) ** 2 - 4.0,
+            (x[0] - 4.0) ** 2 + (x[1] - 1.0) ** 2 - 6.25,
+        ]
+    )
+
+
+def _nlh_fn(x: VectorNf64) -> Scalarf64:
+    return (x[0] - 2.0) ** 2 + (x[1] - 2.0) ** 2 - 1.0
+
+
+def test_convexify_problem(trajopt_params: TrajOptParams) -> None:
+    cost_fn = DerivativeSplicedCostFn(core_fn=_convex_cost_fn, use_jit=False)
+    lg_fn = DerivativeSplicedConstraintsFn(core_fn=_lg_fn, use_jit=False)
+    lh_fn = DerivativeSplicedConstraintsFn(core_fn=_lh_fn, use_jit=False)
+    nlg_fn = DerivativeSplicedConstraintsFn(core_fn=_nlg_fn, use_jit=False)
+    nlh_fn = DerivativeSplicedConstraintsFn(core_fn=_nlh_fn, use_jit=False)
+    trajopt = TrajOpt(
+        params=trajopt_params,
+        cost_fn=cost_fn,
+        linear_inequality_constraints_fn=lg_fn,
+        linear_equality_constraints_fn=lh_fn,
+        non_linear_inequality_constraints_fn=nlg_fn,
+        non_linear_equality_constraints_fn=nlh_fn,
+    )
+    x, mu = np.array([0.3, -0.7]), 10.0
+    n = x.size
+    qp_inputs = trajopt.convexify_problem(x=x, mu=mu)
+
+    # Dense QP, assembled block by block directly from the convexification formulas.
+    lg0, W_lg = np.asarray(lg_fn(x)), np.asarray(lg_fn.grad(x))
+    lh0, W_lh = np.reshape(lh_fn(x), 1), np.reshape(lh_fn.grad(x), (1, n))
+    nlg0, W_nlg = np.asarray(nlg_fn(x)), np.asarray(nlg_fn.grad(x))
+    nlh0, W_nlh = np.reshape(nlh_fn(x), 1), np.reshape(nlh_fn.grad(x), (1, n))
+    Omegas = [
+        *np.moveaxis(np.asarray(nlg_fn.hess(x)), 2, 0),
+        np.asarray(nlh_fn.hess(x)),
+    ]
+    omega_f, W_f = np.asarray(cost_fn.grad(x)), np.asarray(cost_fn.hess(x))
+    # Slack variables [t_g, t_h, s_h]
+    num_slack_variables = 2 + 2 * 1
+    A = np.vstack(
+        (
+            np.hstack((W_lg, np.zeros((2, num_slack_variables)))),
+            np.hstack((W_lh, np.zeros((1, num_slack_variables)))),
+            np.hstack((W_nlg, -np.eye(2), np.zeros((2, 2)))),
+            np.hstack((W_nlh, np.zeros((1, 2)), [[1.0, -1.0]])),
+            np.hstack(
+                (np.zeros((num_slack_variables, n)), np.eye(num_slack_variables))
+            ),
+        )
+    )
+    lb = np.hstack(
+        (
+            np.full(2, -np.inf),
+            W_lh @ x - lh0,
+            np.full(2, -np.inf),
+            W_nlh @ x - nlh0,
+            np.zeros(num_slack_variables),
+        )
+    )
+    ub = np.hstack(
+        (
+            W_lg @ x - lg0,
+            W_lh @ x - lh0,
+            W_nlg @ x - nlg0,
+            W_nlh @ x - nlh0,
+            np.full(num_slack_variables, np.inf),
+        )
+    )
+    P = np.zeros((n + num_slack_variables, n + num_slack_variables))
+    P[:n, :n] = W_f + mu * sum(Omegas)
+    q = omega_f - 0.5 * (W_f + W_f.T) @ x
+    for Omega in Omegas:
+        q -= 0.5 * mu * (Omega + Omega.T) @ x
+    q = np.hstack((q, np.full(num_slack_variables, mu)))
+
+    # Only the upper triangle of P is constructed.
+    P_triu = qp_inputs.P.toarray()
+    np.testing.assert_array_equal(np.tril(P_triu, k=-1), 0.0)
+    np.testing.assert_allclose(P_triu + np.triu(P_triu, k=1).T, P)
+    np.testing.assert_allclose(qp_inputs.q, q)
+    # The last n rows are the (unbounded) trust region rows.
+    A_qp = qp_inputs.A.toarray()
+    np.testing.assert_allclose(A_qp[:-n], A)
+    np.testing.assert_array_equal(lb, qp_inputs.lb[:-n])
+    np.testing.assert_allclose(qp_inputs.ub[:-n], ub)
+    np.testing.assert_array_equal(A_qp[-n:], np.eye(n, A.shape[1]))
+    np.testing.assert_array_equal(qp_inputs.lb[-n:], -np.inf)
+    np.testing.assert_array_equal(qp_inputs.ub[-n:], np.inf)
+
+
+def test_solve(trajopt_params: TrajOptParams) -> None:
+    # Rosenbrock with x >= 2, y >= -5 and (x - 2)^2 + (y - 2)^2 <= 2^2
+    rosenbrock_params = RosenbrockParams(a=1.0, b=100.0)
+    trajopt = TrajOpt(
+        params=trajopt_params,
+        cost_fn=DerivativeSplicedCostFn(
+            core_fn=rosenbrock_cost_fn,
+            use_jit=True,
+            construct_params_fn=lambda x: rosenbrock_params,
+        ),
+        linear_inequality_constraints_fn=DerivativeSplicedConstraintsFn(
+            core_fn=lambda z: jnp.array([2.0 - z[0], -5.0 - z[1]], dtype=jnp.float32),
+            use_jit=True,
+        ),
+        non_linear_inequality_constraints_fn=DerivativeSplicedConstraintsFn(
+            core_fn=lambda z: jnp.array(
+                (z[0] - 2.0) ** 2 + (z[1] - 2.0) ** 2 - 2.0**2, dtype=jnp.float32
+            ),
+            use_jit=True,
+        ),
+    )
+    result = trajopt.solve(initial_guess_x=np.array([5.0, -5.0]))
+
+    np.testing.assert_allclose(result.solution_x(), [2.0, 3.9896], atol=1e-4)
+    # The exact number of entries depends on the QP solver tolerances, so this is only a
+    # loose bound to catch the iterations growing a lot.
+    assert len(result) <= 64
+    assert trajopt.are_constraints_satisfied(x=result.solution_x())
+
+
+def test_memoized_opt_fn() -> None:
+    num_calls = 0
+
+    def f(x: VectorNf64) -> Scalarf64:
+        nonlocal num_calls
+        num_calls += 1
+        return jnp.sum(x**2)
+
+    fn_memo = _MemoizedOptFn(fn=DerivativeSplicedCostFn(core_fn=f, use_jit=False))
+
+    x = np.array([1.0, 2.0])
+    assert fn_memo(x) == 5.0
+    assert num_calls == 1
+    # Hit for an equal x, even if it is a different array.
+    assert fn_memo(np.array([1.0, 2.0])) == 5.0
+    assert num_calls == 1
+    # Miss for a different x.
+    assert fn_memo(np.array([1.0, 3.0])) == 10.0
+    assert num_calls == 2
+    # Modifying x in place doesn't give the memoized value at the old x.
+    x[1] = 4.0
+    assert fn_memo(x) == 17.0
+    assert num_calls == 3
+    np.testing.assert_array_equal(x, [1.0, 4.0])
+
+    # Values, gradients and hessians evaluated together are memoized individually.
+    x = np.array([2.0, 2.0])
+    value, grad, hess = fn_memo.value_grad_hess(x)
+    num_calls_after_evaluation = num_calls
+    assert fn_memo(x) is value
+    assert fn_memo.grad(x) is grad
+    assert fn_memo.hess(x) is hess
+    assert num_calls == num_calls_after_evaluation
+
+    fn_memo.clear()
+    assert fn_memo(x) == 8.0
+    assert num_calls == num_calls_after_evaluation + 1
+
+
+@pytest.mark.parametrize(
+    "invalid_derivative",
+    [None, "cost_grad", "cost_hess", "constraints_grad", "constraints_hess"],
+)
+def test_validate_constraint_shapes(
+    trajopt_params: TrajOptParams,
+    invalid_derivative: str,
+) -> None:
+    n = 2
+    x = np.zeros(n)
+
+    def _derivative_fns(name: str):
+        # Gradient and hessian of the wrong shapes, if required.
+        derivative_fns = {}
+        if invalid_derivative == f"{name}_grad":
+            derivative_fns["grad_fn"] = lambda x: jnp.zeros((1, n))
+        if invalid_derivative == f"{name}_hess":
+            derivative_fns["hess_fn"] = lambda x: jnp.zeros((n, n, 1))
+        return derivative_fns
+
+    trajopt = TrajOpt(
+        params=trajopt_params,
+        cost_fn=DerivativeSplicedCostFn(
+            core_fn=_quadratic_cost_fn,
+            use_jit=False,
+            **_derivative_fns("cost"),
+        ),
+        non_linear_inequality_constraints_fn=DerivativeSplicedConstraintsFn(
+            core_fn=_circle_constraints_fn,
+            use_jit=False,
+            **_derivative_fns("constraints"),
+        ),
+    )
+
+    if invalid_derivative is None:
+        trajopt._validate_constraint_shapes(x=x)
+    else:
+        with pytest.raises(AtiumOptError):
+            trajopt._validate_constraint_shapes(x=x)
+
+
+def test_convexify_problem_for_different_sizes_of_x(
+    trajopt_params: TrajOptParams,
+) -> None:
+    trajopt = TrajOpt(
+        params=trajopt_params,
+        cost_fn=DerivativeSplicedCostFn(core_fn=_quadratic_cost_fn, use_jit=False),
+        non_linear_inequality_constraints_fn=DerivativeSplicedConstraintsFn(
+            core_fn=_circle_constraints_fn,
+            use_jit=False,
+        ),
+    )
+    # The constraint assemblers are specialized again for a different size of x.
+    for n in (2, 3):
+        qp_inputs = trajopt.convexify_problem(x=np.zeros(n), mu=1.0)
+        # One slack variable and (constraint, slack, n trust region) rows.
+        assert qp_inputs.P.shape == (n + 1, n + 1)
+        assert qp_inputs.A.shape == (n + 2, n + 1)
+        np.testing.assert_array_equal(qp_inputs.A.toarray()[0, :n], np.zeros(n))
@@ -16,7 +16,9 @@ class AttrsConverters:
         precision: Optional[int] = None,
     ) -> AttrsConverterFunc:
         def _np_array_converter(value) -> NpArrf64:
-            np_value = np.array(value, dtype=np.float64)
+            # Always a C-contiguous copy, even for strided/transposed inputs, so that
+            # downstream arithmetic doesn't incur hidden copies.
+            np_value = np.array(value, dtype=np.float64, order="C")
             if precision is not None:
                 np_value = np_value.round(precision)
             return np_value
@@ -119,8 +119,13 @@ AnglesRad = VectorNf64
 AngleOrAnglesRad = Union[float, AnglesRad]
 PointXYVector = Vector2f64
 PolygonXYArray = MatrixN2f64
+PolygonXYTensor = TensorLMNf64
 PointXYArray = MatrixN2f64
+PointXYTensor = TensorLMNf64
 SizeXYVector = Vector2f64
+SizeXYArray = MatrixN2f64
+# Half planes [a_x, a_y, b] (a.p <= b) of one or more time steps/obstacles, of shape (..., 4, 3).
+HalfspacesXYTensor = Arrf64
 CoordinateXY = Tuple[float, float]
 
 
@@ -138,6 +143,8 @@ StateDerivativeFn = Callable[[StateVector, ControlInputVector], StateDerivativeV
 VelocityXYArray = MatrixN2f64
 StateTrajectoryArray = MatrixMNf64
 ControlTrajectoryArray = MatrixMNf64
+StateTrajectoryTensor = TensorLMNf64
+ControlTrajectoryTensor = TensorLMNf64
 
 # Optimization
 CostVector = VectorNf64
@@ -21,6 +21,9 @@ class AtiumLogger:
         _l.setLevel(self.level)
         return _l
 
+    def is_enabled_for(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
     def debug(self, message: str) -> None:
         self._logger.debug(message)
 
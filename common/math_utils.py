@@ -1,6 +1,6 @@
 import numpy as np
 
-from common.custom_types import MatrixNNf64
+from common.custom_types import MatrixNNf64, TensorLMNf64
 
 
 def assert_matrix_positive_definite(mat: MatrixNNf64) -> None:
@@ -13,3 +13,12 @@ def assert_matrix_positive_semidefinite(mat: MatrixNNf64) -> None:
     assert mat.ndim == 2
     assert mat.shape[0] == mat.shape[1]
     assert np.all(np.linalg.eigvals(mat) >= 0)
+
+
+def assert_matrices_positive_semidefinite(mats: TensorLMNf64) -> None:
+    """
+    Same as assert_matrix_positive_semidefinite for a (L, N, N) stack of matrices.
+    """
+    assert mats.ndim == 3
+    assert mats.shape[1] == mats.shape[2]
+    assert np.all(np.linalg.eigvals(mats) >= 0)
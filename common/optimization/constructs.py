@@ -1,4 +1,7 @@
+from typing import Union
+
 import attr
+import scipy.sparse as sp
 
 from common.custom_types import MatrixMNf64, MatrixNNf64, VectorNf64
 
@@ -9,10 +12,12 @@ class QPInputs:
     Inputs to a QP optimization problem
     J = 0.5 * x^T @ P @ x + q^T @ x
     s.t lb <= Ax <= ub
+    P and A can either be dense or sparse (preferably CSC, which is what OSQP uses).
+    Only the upper triangle of P is used, so P may be given as upper triangular.
     """
 
-    P: MatrixNNf64
+    P: Union[MatrixNNf64, sp.spmatrix]
     q: VectorNf64
-    A: MatrixMNf64
+    A: Union[MatrixMNf64, sp.spmatrix]
     lb: VectorNf64
     ub: VectorNf64
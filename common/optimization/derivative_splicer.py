@@ -1,5 +1,5 @@
 import inspect
-from typing import Any, Callable, Generic, Optional, TypeVar
+from typing import Any, Callable, Generic, Optional, Tuple, TypeVar
 
 import attr
 from jax import hessian, jacfwd, jit
@@ -147,6 +147,21 @@ class DerivativeSplicedOptFn(Generic[TOptInput, TOptOutput]):
         else:
             return self._hess_fn(x, params)
 
+    def value_grad_hess(self, x: ScalarOrVectorNf64) -> Tuple[Any, Any, Any]:
+        """
+        Computes the value, gradient and hessian at x together, constructing the params
+        only once. Equivalent to (self(x), self.grad(x), self.hess(x)).
+        """
+        params = self.construct_params(x=x)
+        if params is None:
+            return self.core_fn(x), self._grad_fn(x), self._hess_fn(x)
+        else:
+            return (
+                self.core_fn(x, params),
+                self._grad_fn(x, params),
+                self._hess_fn(x, params),
+            )
+
     def convexified(self, x: ScalarOrVectorNf64, new_x: ScalarOrVectorNf64) -> Any:
         # Params construction is done internally, so we only need to pass in x.
         params = self.construct_params(x=x)
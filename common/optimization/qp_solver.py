@@ -1,26 +1,133 @@
+from typing import Any, Optional, Union
+
+import attr
+import numpy as np
 import osqp
-from scipy.sparse import csc_matrix
+import scipy.sparse as sp
 
+from common.custom_types import MatrixMNf64
 from common.optimization.constructs import QPInputs
 
 OSQP_SOLVED_STATUS_STR = "solved"
 
 
-def solve_qp(qp_inputs: QPInputs, verbose: bool = False) -> None:
+def _as_csc_matrix(mat: Union[MatrixMNf64, sp.spmatrix]) -> sp.csc_matrix:
+    # Avoiding a copy if it is already in the format that OSQP requires.
+    if sp.issparse(mat) and mat.format == "csc":
+        return mat
+    return sp.csc_matrix(mat)
+
+
+def _as_upper_triangular_csc_matrix(
+    mat: Union[MatrixMNf64, sp.spmatrix],
+) -> sp.csc_matrix:
+    # OSQP only keeps the upper triangle of P on setup, so any update of its values
+    # must only include those too (OSQP ignores updates with more elements).
+    return sp.triu(mat, format="csc")
+
+
+def _have_same_sparsity(mat: sp.csc_matrix, other_mat: sp.csc_matrix) -> bool:
+    return (
+        mat.shape == other_mat.shape
+        and np.array_equal(mat.indptr, other_mat.indptr)
+        and np.array_equal(mat.indices, other_mat.indices)
+    )
+
+
+def _setup_osqp_solver(
+    P: sp.csc_matrix,
+    A: sp.csc_matrix,
+    qp_inputs: QPInputs,
+    verbose: bool,
+) -> osqp.OSQP:
     solver = osqp.OSQP()
     # Not using **attr.asdict in case the interface changes in the future or we need to add more options.
     settings = dict(
         verbose=verbose,
     )
     solver.setup(
-        P=csc_matrix(qp_inputs.P),
+        P=P,
         q=qp_inputs.q,
-        A=csc_matrix(qp_inputs.A),
+        A=A,
         l=qp_inputs.lb,
         u=qp_inputs.ub,
         **settings,
     )
-    return solver.solve()
+    return solver
+
+
+def solve_qp(qp_inputs: QPInputs, verbose: bool = False) -> Any:
+    solver = _setup_osqp_solver(
+        P=_as_csc_matrix(qp_inputs.P),
+        A=_as_csc_matrix(qp_inputs.A),
+        qp_inputs=qp_inputs,
+        verbose=verbose,
+    )
+    # Failures are reported through the status of the results (see is_qp_solved).
+    return solver.solve(raise_error=False)
+
+
+@attr.define
+class WarmStartedQPSolver:
+    """
+    Solves a sequence of QPs, reusing the OSQP workspace between them.
+    If the sparsity of P and A is the same as that of the previous QP, only the inputs that
+    changed are updated (P and A changing requires a refactorization, the vectors don't)
+    and OSQP warm starts from the previous solution. Otherwise the QP is setup from scratch.
+    Inputs are compared by identity, so they must not be modified in place once solved.
+    P may be full (symmetric) or upper triangular, as only its upper triangle is used.
+    """
+
+    verbose: bool = False
+    _solver: Optional[osqp.OSQP] = attr.ib(init=False, default=None, repr=False)
+    _P: Optional[sp.csc_matrix] = attr.ib(init=False, default=None, repr=False)
+    _A: Optional[sp.csc_matrix] = attr.ib(init=False, default=None, repr=False)
+    _qp_inputs: Optional[QPInputs] = attr.ib(init=False, default=None, repr=False)
+
+    def reset(self) -> None:
+        self._solver = None
+        self._P, self._A, self._qp_inputs = None, None, None
+
+    def solve(self, qp_inputs: QPInputs) -> Any:
+        # Returns the OSQP results (see is_qp_solved).
+        # P and A are only converted again if they aren't the ones of the previous QP.
+        if self._qp_inputs is not None and qp_inputs.P is self._qp_inputs.P:
+            P = self._P
+        else:
+            P = _as_upper_triangular_csc_matrix(qp_inputs.P)
+        if self._qp_inputs is not None and qp_inputs.A is self._qp_inputs.A:
+            A = self._A
+        else:
+            A = _as_csc_matrix(qp_inputs.A)
+
+        if (
+            self._solver is None
+            or not _have_same_sparsity(P, self._P)
+            or not _have_same_sparsity(A, self._A)
+        ):
+            self._solver = _setup_osqp_solver(
+                P=P,
+                A=A,
+                qp_inputs=qp_inputs,
+                verbose=self.verbose,
+            )
+        else:
+            update_kwargs = {}
+            if P is not self._P:
+                update_kwargs["Px"] = P.data
+            if A is not self._A:
+                update_kwargs["Ax"] = A.data
+            if qp_inputs.q is not self._qp_inputs.q:
+                update_kwargs["q"] = qp_inputs.q
+            if qp_inputs.lb is not self._qp_inputs.lb:
+                update_kwargs["l"] = qp_inputs.lb
+            if qp_inputs.ub is not self._qp_inputs.ub:
+                update_kwargs["u"] = qp_inputs.ub
+            if update_kwargs:
+                self._solver.update(**update_kwargs)
+
+        self._P, self._A, self._qp_inputs = P, A, qp_inputs
+        return self._solver.solve(raise_error=False)
 
 
 # TODO: Figure out this result type. OSQP documentation smh.
@@ -378,6 +378,46 @@ def test_convexified_fn_on_convex_fn(use_jit: bool):
     )
 
 
+@pytest.mark.parametrize("use_jit", [True, False])
+def test_value_grad_hess(use_jit: bool):
+    """
+    Computing the value, gradient and hessian together must be the same as computing
+    them individually.
+    """
+
+    def f(z: VectorNf64, params: _Params) -> VectorNf64:
+        x, y, theta = z
+        return jnp.array(
+            [
+                params.a * x * jnp.cos(theta) + params.b * y * jnp.sin(theta),
+                x**2 + y**3,
+            ]
+        )
+
+    rng = np.random.RandomState(7)
+    z = rng.randn(3).round(6)
+
+    f_ds = DerivativeSplicedOptFn(
+        core_fn=f,
+        use_jit=use_jit,
+        construct_params_fn=lambda _: _Params(a=2, b=0.5),
+    )
+    value, grad_value, hess_value = f_ds.value_grad_hess(z)
+    np.testing.assert_array_equal(value, f_ds(z))
+    np.testing.assert_array_equal(grad_value, f_ds.grad(z))
+    np.testing.assert_array_equal(hess_value, f_ds.hess(z))
+
+    # Without params.
+    f_ds = DerivativeSplicedOptFn(
+        core_fn=lambda z: jnp.dot(z, z),
+        use_jit=use_jit,
+    )
+    value, grad_value, hess_value = f_ds.value_grad_hess(z)
+    np.testing.assert_almost_equal(value, np.dot(z, z), decimal=6)
+    np.testing.assert_array_almost_equal(grad_value, 2.0 * z, decimal=6)
+    np.testing.assert_array_almost_equal(hess_value, 2.0 * np.eye(3), decimal=6)
+
+
 if __name__ == "__main__":
 
     pytest.main(["-s", "-v", __file__])
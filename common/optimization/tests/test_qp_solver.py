@@ -0,0 +1,94 @@
+import attr
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from common.optimization.constructs import QPInputs
+from common.optimization.qp_solver import (
+    WarmStartedQPSolver,
+    is_qp_solved,
+    solve_qp,
+)
+
+
+@pytest.fixture
+def qp_inputs() -> QPInputs:
+    # min (x0 - 1)^2 + (x1 - 2)^2 s.t x0 + x1 <= 2, -5 <= x <= 5
+    return QPInputs(
+        P=sp.triu(2.0 * sp.eye(2), format="csc"),
+        q=np.array([-2.0, -4.0]),
+        A=sp.csc_matrix(np.array([[1.0, 1.0], [1.0, 0.0], [0.0, 1.0]])),
+        lb=np.array([-np.inf, -5.0, -5.0]),
+        ub=np.array([2.0, 5.0, 5.0]),
+    )
+
+
+def test_warm_started_qp_solver(qp_inputs: QPInputs) -> None:
+    qp_solver = WarmStartedQPSolver()
+
+    results = qp_solver.solve(qp_inputs=qp_inputs)
+    assert is_qp_solved(osqp_results=results)
+    np.testing.assert_allclose(results.x, [0.5, 1.5], atol=1e-2)
+
+    # Only updating the bounds.
+    lb = np.copy(qp_inputs.lb)
+    ub = np.copy(qp_inputs.ub)
+    ub[0] = np.inf
+    ub[2] = 1.0
+    bounds_qp_inputs = QPInputs(
+        P=qp_inputs.P,
+        q=qp_inputs.q,
+        A=qp_inputs.A,
+        lb=lb,
+        ub=ub,
+    )
+    results = qp_solver.solve(qp_inputs=bounds_qp_inputs)
+    assert is_qp_solved(osqp_results=results)
+    np.testing.assert_allclose(results.x, [1.0, 1.0], atol=1e-2)
+    np.testing.assert_allclose(
+        results.x, solve_qp(qp_inputs=bounds_qp_inputs).x, atol=1e-2
+    )
+
+    # Different sparsity, which requires a new setup.
+    sparser_qp_inputs = QPInputs(
+        P=qp_inputs.P,
+        q=qp_inputs.q,
+        A=sp.csc_matrix(np.array([[1.0, 0.0], [0.0, 1.0]])),
+        lb=np.array([-5.0, -5.0]),
+        ub=np.array([5.0, 5.0]),
+    )
+    results = qp_solver.solve(qp_inputs=sparser_qp_inputs)
+    assert is_qp_solved(osqp_results=results)
+    np.testing.assert_allclose(results.x, [1.0, 2.0], atol=1e-2)
+
+
+def test_warm_started_qp_solver_matrix_updates(qp_inputs: QPInputs) -> None:
+    qp_solver = WarmStartedQPSolver()
+
+    # Full (symmetric) P, of which OSQP only keeps the upper triangle.
+    full_P_qp_inputs = attr.evolve(
+        qp_inputs, P=sp.csc_matrix(np.array([[2.0, 0.5], [0.5, 2.0]]))
+    )
+    results = qp_solver.solve(qp_inputs=full_P_qp_inputs)
+    assert is_qp_solved(osqp_results=results)
+    np.testing.assert_allclose(
+        results.x, solve_qp(qp_inputs=full_P_qp_inputs).x, atol=1e-2
+    )
+
+    # Different values of P and A with the same sparsity, which are updated in place.
+    updated_qp_inputs = attr.evolve(
+        full_P_qp_inputs,
+        P=sp.csc_matrix(np.array([[4.0, 1.0], [1.0, 4.0]])),
+        A=sp.csc_matrix(np.array([[1.0, 2.0], [1.0, 0.0], [0.0, 1.0]])),
+    )
+    results = qp_solver.solve(qp_inputs=updated_qp_inputs)
+    assert is_qp_solved(osqp_results=results)
+    np.testing.assert_allclose(results.x, [0.25, 0.875], atol=1e-2)
+    np.testing.assert_allclose(
+        results.x, solve_qp(qp_inputs=updated_qp_inputs).x, atol=1e-2
+    )
+
+
+if __name__ == "__main__":
+
+    pytest.main(["-s", "-v", __file__])